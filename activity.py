@@ -0,0 +1,175 @@
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, case, exists, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from button_config import DEFAULT_BUTTONS
+from db.models import ButtonLink, DataMigration, Linktr, User, UserDailyActivity, DEFAULT_TENANT
+
+# Биты маски user_daily_activity: /start и кнопки в порядке DEFAULT_BUTTONS
+START_BIT = 1
+BUTTON_BITS = {name: 1 << (1 + position) for position, name in enumerate(DEFAULT_BUTTONS)}
+ANY_ACTIVITY = START_BIT | sum(BUTTON_BITS.values())
+
+# Отметка в data_migrations о завершенном backfill_activity
+BACKFILL_MIGRATION = 'activity_backfill'
+
+
+def button_bit(button_name: Optional[str]) -> int:
+    """Бит кнопки в маске активности (0 для неизвестной кнопки)"""
+    return BUTTON_BITS.get(button_name, 0)
+
+
+def dialect_insert(conn):
+    """insert() с ON CONFLICT для диалекта соединения или сессии (SQLite или Postgres)"""
+    dialect = conn.dialect if hasattr(conn, 'dialect') else conn.get_bind().dialect
+    return postgresql_insert if dialect.name == 'postgresql' else sqlite_insert
+
+
+def upsert_user(conn, tenant: str, user_id: int, username: Optional[str], first_name: Optional[str],
+                last_name: Optional[str], seen_at: datetime) -> bool:
+    """
+    Добавляет или обновляет пользователя одним запросом INSERT ... ON CONFLICT DO UPDATE
+    и отмечает last_seen. Возвращает True, если пользователь новый.
+    """
+    stmt = dialect_insert(conn)(User).values(
+        tenant=tenant, user_id=user_id, username=username, first_name=first_name,
+        last_name=last_name, first_seen=seen_at, last_seen=seen_at
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.tenant, User.user_id],
+        set_={
+            'username': stmt.excluded.username,
+            'first_name': stmt.excluded.first_name,
+            'last_name': stmt.excluded.last_name,
+            'first_seen': func.coalesce(User.first_seen, stmt.excluded.first_seen),
+            'last_seen': stmt.excluded.last_seen,
+        }
+    ).returning(User.first_seen)
+    return conn.execute(stmt).scalar_one() == seen_at
+
+
+def record_activity(conn, rows: Iterable[Dict]):
+    """
+    Добавляет биты в дневные маски: INSERT ... ON CONFLICT DO UPDATE SET mask = mask | excluded.mask.
+    rows — словари с ключами tenant, user_id, day, mask; повторы одного дня объединяются заранее.
+    """
+    masks = defaultdict(int)
+    for row in rows:
+        if row['mask']:
+            masks[(row['tenant'], row['user_id'], row['day'])] |= row['mask']
+    if not masks:
+        return
+
+    insert = dialect_insert(conn)
+    stmt = insert(UserDailyActivity)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserDailyActivity.tenant, UserDailyActivity.user_id, UserDailyActivity.day],
+        set_={'mask': UserDailyActivity.mask.op('|')(stmt.excluded.mask)}
+    )
+    conn.execute(stmt, [
+        {'tenant': tenant, 'user_id': user_id, 'day': day, 'mask': mask}
+        for (tenant, user_id, day), mask in masks.items()
+    ])
+
+
+_touch_users = (
+    update(User.__table__)
+    .where(User.tenant == bindparam('b_tenant'), User.user_id == bindparam('b_user_id'))
+    .values(
+        first_seen=func.coalesce(User.first_seen, bindparam('b_first_seen')),
+        last_seen=case(
+            (or_(User.last_seen.is_(None), User.last_seen < bindparam('b_last_seen')), bindparam('b_last_seen')),
+            else_=User.last_seen
+        )
+    )
+)
+
+
+def touch_users(conn, events: Iterable[Dict]):
+    """Обновляет first_seen/last_seen по событиям с ключами tenant, user_id, created_at"""
+    seen: Dict[tuple, List[datetime]] = {}
+    for event in events:
+        key = (event['tenant'], event['user_id'])
+        created_at = event['created_at']
+        if key in seen:
+            bounds = seen[key]
+            bounds[0] = min(bounds[0], created_at)
+            bounds[1] = max(bounds[1], created_at)
+        else:
+            seen[key] = [created_at, created_at]
+    if seen:
+        conn.execute(_touch_users, [
+            {'b_tenant': tenant, 'b_user_id': user_id, 'b_first_seen': first, 'b_last_seen': last}
+            for (tenant, user_id), (first, last) in seen.items()
+        ])
+
+
+def needs_backfill(engine, tenant: str = DEFAULT_TENANT) -> bool:
+    """
+    Есть переходы, а восстановление активности по ним еще не завершалось.
+    Прерванное восстановление (часть порций уже записана) запускается заново.
+    """
+    with engine.connect() as conn:
+        return conn.scalar(select(
+            exists().where(Linktr.tenant == tenant)
+            & ~exists().where(DataMigration.name == BACKFILL_MIGRATION, DataMigration.tenant == tenant)
+        ))
+
+
+def backfill_activity(engine, tenant: str = DEFAULT_TENANT, chunk_size: int = 50000):
+    """
+    Строит маски активности и first_seen/last_seen по уже записанным переходам
+    и в последней транзакции отмечает завершение в data_migrations.
+    Повторный запуск безопасен: биты объединяются через OR, границы — через min/max.
+    Старые /start не восстанавливаются — они нигде не записывались.
+    """
+    day = func.date(Linktr.created_at)
+    query = (
+        select(Linktr.user_id, day, ButtonLink.button_name)
+        .join(ButtonLink, ButtonLink.id == Linktr.button_id)
+        .where(Linktr.tenant == tenant)
+        .group_by(Linktr.user_id, day, ButtonLink.button_name)
+    )
+    total = 0
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for chunk in result.partitions():
+            # Порция — отдельная транзакция, чтобы не задерживать запись переходов
+            with engine.begin() as write_conn:
+                record_activity(write_conn, (
+                    {'tenant': tenant, 'user_id': user_id, 'day': date.fromisoformat(str(click_day)[:10]),
+                     'mask': button_bit(button_name)}
+                    for user_id, click_day, button_name in chunk
+                ))
+            total += len(chunk)
+
+    clicks = select(Linktr.created_at).where(Linktr.tenant == User.tenant, Linktr.user_id == User.user_id)
+    first_click = clicks.with_only_columns(func.min(Linktr.created_at)).scalar_subquery()
+    last_click = clicks.with_only_columns(func.max(Linktr.created_at)).scalar_subquery()
+    with engine.begin() as conn:
+        conn.execute(
+            update(User.__table__)
+            .where(User.tenant == tenant)
+            .values(
+                first_seen=case(
+                    (or_(User.first_seen.is_(None), User.first_seen > first_click), first_click),
+                    else_=User.first_seen
+                ),
+                last_seen=case(
+                    (or_(User.last_seen.is_(None), User.last_seen < last_click), last_click),
+                    else_=User.last_seen
+                )
+            )
+        )
+        insert = dialect_insert(conn)
+        conn.execute(
+            insert(DataMigration)
+            .values(name=BACKFILL_MIGRATION, tenant=tenant, completed_at=datetime.now())
+            .on_conflict_do_nothing(index_elements=[DataMigration.name, DataMigration.tenant])
+        )
+    logging.info("Активность бренда %s восстановлена по переходам: %d пользователе-дней", tenant, total)
@@ -0,0 +1,132 @@
+import html
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from button_config import get_active_buttons, get_button_config_by_id
+from db.models import Linktr, User, DEFAULT_TENANT
+
+PAGE_SIZE = 10
+_EPOCH = datetime(1970, 1, 1)
+
+
+class ClicksPage(CallbackData, prefix="cp"):
+    """Компактные данные кнопок навигации: курсор, направление и фильтры"""
+    ts: int = 0   # created_at курсора в микросекундах от эпохи, 0 — первая страница
+    id: int = 0   # id записи курсора
+    d: str = "n"  # n — к более старым, p — к более новым
+    b: int = 0    # фильтр по button_id
+    u: int = 0    # фильтр по user_id
+
+
+def encode_ts(value: datetime) -> int:
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def decode_ts(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def fetch_clicks_page(session: Session, page: ClicksPage, tenant: str = DEFAULT_TENANT,
+                      limit: int = PAGE_SIZE) -> Tuple[List, bool]:
+    """
+    Страница переходов (новые сверху) с keyset-пагинацией по (created_at, id).
+
+    Возвращает строки и признак того, что в направлении page.d есть еще записи.
+    Стоимость запроса не зависит от размера таблицы и номера страницы.
+    """
+    query = (
+        select(Linktr.id, Linktr.created_at, Linktr.user_id, Linktr.button_id, Linktr.link,
+               User.username, User.first_name)
+        .outerjoin(User, (User.tenant == Linktr.tenant) & (User.user_id == Linktr.user_id))
+        .where(Linktr.tenant == tenant)
+    )
+    if page.b:
+        query = query.where(Linktr.button_id == page.b)
+    if page.u:
+        query = query.where(Linktr.user_id == page.u)
+
+    key = tuple_(Linktr.created_at, Linktr.id)
+    if page.ts:
+        cursor = tuple_(decode_ts(page.ts), page.id)
+        query = query.where(key > cursor if page.d == "p" else key < cursor)
+
+    if page.d == "p":
+        query = query.order_by(Linktr.created_at.asc(), Linktr.id.asc())
+    else:
+        query = query.order_by(Linktr.created_at.desc(), Linktr.id.desc())
+
+    rows = session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if page.d == "p":
+        rows.reverse()
+    return rows, has_more
+
+
+def _link_label(button_id: Optional[int], link: Optional[str]) -> str:
+    if button_id:
+        config = get_button_config_by_id(button_id)
+        return config['button_name'] if config else f"#{button_id}"
+    return html.escape(link) if link else "—"
+
+
+def format_clicks_page(rows: List, page: ClicksPage, snapshot_time: Optional[datetime]) -> str:
+    """Текст сообщения со страницей переходов"""
+    text = "🕘 <b>Последние переходы</b>\n"
+    if page.b:
+        text += f"Кнопка: {_link_label(page.b, None)}\n"
+    if page.u:
+        text += f"Пользователь: {page.u}\n"
+    if snapshot_time:
+        text += f"<i>Данные на {snapshot_time.strftime('%d.%m.%Y %H:%M')}</i>\n"
+    text += "\n"
+
+    if not rows:
+        return text + "Записей нет"
+
+    for row in rows:
+        name = html.escape(f"@{row.username}" if row.username else (row.first_name or ""))
+        text += (f"{row.created_at.strftime('%d.%m %H:%M')} · {row.user_id} {name} · "
+                 f"{_link_label(row.button_id, row.link)}\n")
+    return text
+
+
+def build_clicks_keyboard(rows: List, page: ClicksPage, has_more: bool,
+                          tenant: str = DEFAULT_TENANT) -> InlineKeyboardMarkup:
+    """Навигация по страницам и фильтры по кнопкам"""
+    builder = InlineKeyboardBuilder()
+
+    nav = []
+    if rows:
+        first, last = rows[0], rows[-1]
+        if (page.d == "p" and has_more) or (page.d == "n" and page.ts):
+            nav.append(InlineKeyboardButton(
+                text="◀️ Новее",
+                callback_data=ClicksPage(ts=encode_ts(first.created_at), id=first.id, d="p", b=page.b, u=page.u).pack()
+            ))
+        if (page.d == "n" and has_more) or page.d == "p":
+            nav.append(InlineKeyboardButton(
+                text="Старее ▶️",
+                callback_data=ClicksPage(ts=encode_ts(last.created_at), id=last.id, d="n", b=page.b, u=page.u).pack()
+            ))
+    if nav:
+        builder.row(*nav)
+
+    builder.row(*[
+        InlineKeyboardButton(
+            text=("• " if config['id'] == page.b else "") + config['button_name'],
+            callback_data=ClicksPage(b=config['id'], u=page.u).pack()
+        )
+        for config in get_active_buttons(tenant)
+    ], width=3)
+    builder.row(
+        InlineKeyboardButton(text="🔄 Все", callback_data=ClicksPage().pack()),
+        InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_admin")
+    )
+    return builder.as_markup()
@@ -0,0 +1,64 @@
+"""
+Скорость движка когорт на синтетической активности: построение матрицы
+удержания и воронок по кнопкам для N пользователей (по умолчанию 1 млн,
+в среднем ~6 активных дней на пользователя за полгода).
+
+Запуск: python benchmarks/bench_cohorts.py [пользователей]
+БД не используется — массивы создаются сразу в памяти.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_matrix(user_count: int, seed: int = 1):
+    from cohorts import ActivityMatrix
+
+    rng = np.random.default_rng(seed)
+    days_per_user = rng.geometric(0.2, user_count)
+    user_ids = np.repeat(np.arange(user_count, dtype=np.int64) + 10 ** 9, days_per_user)
+    first_day = np.repeat(rng.integers(20000, 20180, user_count), days_per_user)
+    days = first_day + rng.geometric(0.05, len(user_ids)) - 1
+    days[np.r_[0, np.cumsum(days_per_user)[:-1]]] = first_day[np.r_[0, np.cumsum(days_per_user)[:-1]]]
+    masks = rng.integers(1, 64, len(user_ids))
+
+    order = np.lexsort((days, user_ids))
+    user_ids, days, masks = user_ids[order], days[order], masks[order]
+    # Одна строка на пользователя и день, как в user_daily_activity
+    unique = np.ones(len(user_ids), dtype=bool)
+    unique[1:] = (user_ids[1:] != user_ids[:-1]) | (days[1:] != days[:-1])
+    return ActivityMatrix(user_ids[unique], days[unique], masks[unique])
+
+
+def measure(name: str, func, repeat: int = 5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    print(f"{name:<40} {min(timings) * 1000:>8.1f} мс")
+
+
+def main(user_count: int):
+    from activity import BUTTON_BITS
+    from cohorts import link_funnels, retention
+
+    started = time.perf_counter()
+    matrix = make_matrix(user_count)
+    print(f"Пользователей: {matrix.user_count}, строк активности: {len(matrix.days)} "
+          f"({(matrix.days.nbytes + matrix.masks.nbytes + matrix.user_index.nbytes) / 2 ** 20:.0f} МБ), "
+          f"подготовка {time.perf_counter() - started:.1f} с")
+
+    measure("удержание по неделям, любое действие", lambda: retention(matrix, 7, 8))
+    measure("удержание по неделям, каталог", lambda: retention(matrix, 7, 8, BUTTON_BITS['catalog']))
+    measure("удержание по дням, 30 дней", lambda: retention(matrix, 1, 30))
+    measure("воронки по всем кнопкам", lambda: link_funnels(matrix))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,80 @@
+"""
+Сравнение задержки вызова logger.info() в обработчике:
+синхронный FileHandler против очереди с фоновым пакетным слушателем.
+
+Запуск: python benchmarks/bench_logging.py [количество_сообщений]
+"""
+import logging
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_setup import BatchingQueueListener, JsonFormatter, LazyQueueHandler, SamplingFilter
+
+
+def measure(logger: logging.Logger, count: int) -> list:
+    timings = []
+    for i in range(count):
+        start = time.perf_counter_ns()
+        logger.info("Сохранен переход пользователя %s по ссылке: %s", 100000 + i, "https://gravtool.ru/catalog")
+        timings.append(time.perf_counter_ns() - start)
+    return timings
+
+
+def report(name: str, timings: list):
+    timings.sort()
+    p99 = timings[int(len(timings) * 0.99)]
+    print(f"{name:<40} среднее {statistics.mean(timings) / 1000:7.2f} мкс   p99 {p99 / 1000:7.2f} мкс")
+
+
+def main(count: int):
+    formatter = JsonFormatter()
+    with tempfile.TemporaryDirectory() as tmp:
+        # 1. Синхронная запись в файл, как при logging.basicConfig(filename=...)
+        sync_logger = logging.getLogger('bench.sync')
+        sync_logger.propagate = False
+        sync_logger.setLevel(logging.INFO)
+        file_handler = logging.FileHandler(os.path.join(tmp, 'sync.log'), encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        sync_logger.addHandler(file_handler)
+        report('FileHandler (синхронно)', measure(sync_logger, count))
+        file_handler.close()
+
+        # 2. Очередь + фоновый пакетный слушатель
+        queued_logger = logging.getLogger('bench.queued')
+        queued_logger.propagate = False
+        queued_logger.setLevel(logging.INFO)
+        log_queue = queue.SimpleQueue()
+        queued_logger.addHandler(LazyQueueHandler(log_queue))
+        target = logging.FileHandler(os.path.join(tmp, 'queued.log'), encoding='utf-8')
+        target.setFormatter(formatter)
+        listener = BatchingQueueListener(log_queue, [target])
+        listener.start()
+        report('LazyQueueHandler + пакетная запись', measure(queued_logger, count))
+        drain_start = time.perf_counter()
+        listener.stop()
+        print(f"{'':<40} дозапись очереди: {time.perf_counter() - drain_start:.3f} с")
+
+        # 3. То же с выборкой 1 из 10 для частых сообщений
+        sampled_logger = logging.getLogger('bench.sampled')
+        sampled_logger.propagate = False
+        sampled_logger.setLevel(logging.INFO)
+        log_queue = queue.SimpleQueue()
+        handler = LazyQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter({'bench.sampled': 0.1}))
+        sampled_logger.addHandler(handler)
+        target = logging.FileHandler(os.path.join(tmp, 'sampled.log'), encoding='utf-8')
+        target.setFormatter(formatter)
+        listener = BatchingQueueListener(log_queue, [target])
+        listener.start()
+        report('LazyQueueHandler + выборка 10%', measure(sampled_logger, count))
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
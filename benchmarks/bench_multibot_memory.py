@@ -0,0 +1,54 @@
+"""
+Сравнение занимаемой памяти (RSS): N отдельных процессов по одному боту
+против одного процесса, обслуживающего N ботов.
+
+Каждый процесс импортирует bot.py (aiogram, SQLAlchemy, pandas), создает БД
+и кнопки для своих брендов, как при запуске. Сеть не используется.
+
+Запуск: python benchmarks/bench_multibot_memory.py [N ...]   (Linux, /proc)
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_CODE = """
+import sys
+sys.path.insert(0, {root!r})
+import bot
+bot.create_db()
+for tenant in bot.bots:
+    bot.init_default_buttons(tenant)
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmRSS:'):
+            print(int(line.split()[1]))
+"""
+
+
+def run_process(tenant_count: int, prefix: str) -> int:
+    """Запускает процесс с tenant_count ботами, возвращает RSS в КБ"""
+    tenants = {f"{prefix}{i}": f"{100000 + i}:FAKE-TOKEN-{i}" for i in range(tenant_count)}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, TENANTS=json.dumps(tenants))
+        env.pop('BOT_TOKEN', None)
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD_CODE.format(root=ROOT)],
+            cwd=tmp, env=env, capture_output=True, text=True, check=True
+        )
+    return int(result.stdout.strip().splitlines()[-1])
+
+
+def main(counts):
+    print(f"{'ботов':>6} {'N процессов, МБ':>17} {'1 процесс, МБ':>15} {'экономия':>9}")
+    for count in counts:
+        separate = sum(run_process(1, f"brand{i}_") for i in range(count))
+        shared = run_process(count, "brand")
+        print(f"{count:>6} {separate / 1024:>17.1f} {shared / 1024:>15.1f} {1 - shared / separate:>8.0%}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 2, 5, 10])
@@ -0,0 +1,90 @@
+"""
+Нагрузочный тест сервера редиректов: время обработчика внутри процесса
+и число редиректов в секунду по HTTP с keep-alive.
+
+Запуск: python benchmarks/bench_redirect.py [запросов] [параллельность]
+Работает во временном каталоге со своей БД SQLite.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+async def bench_handler(app, paths, count: int):
+    from aiohttp.test_utils import make_mocked_request
+
+    handler = next(iter(app.router.routes())).handler
+    timings = []
+    for i in range(count):
+        button_id, user_id, sig = paths[i % len(paths)]
+        request = make_mocked_request(
+            'GET', f'/r/{button_id}/{user_id}/{sig}', app=app,
+            match_info={'button_id': str(button_id), 'user_id': str(user_id), 'sig': sig}
+        )
+        start = time.perf_counter_ns()
+        response = await handler(request)
+        timings.append(time.perf_counter_ns() - start)
+        assert response.status == 302
+    timings.sort()
+    print(f"Обработчик: среднее {statistics.mean(timings) / 1000:.1f} мкс, "
+          f"p99 {timings[int(len(timings) * 0.99)] / 1000:.1f} мкс")
+
+
+async def bench_http(urls, count: int, concurrency: int):
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as client:
+        counter = iter(range(count))
+
+        async def worker():
+            for i in counter:
+                async with client.get(urls[i % len(urls)], allow_redirects=False) as response:
+                    assert response.status == 302
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    print(f"HTTP: {count} редиректов за {elapsed:.2f} с — {count / elapsed:.0f} запросов/с")
+
+
+async def main(count: int, concurrency: int):
+    from db.engine import create_db
+    from button_config import init_default_buttons, get_button_config, DEFAULT_BUTTONS
+    from click_pipeline import ClickRecorder
+    from click_redirect import create_redirect_app, start_redirect_server, build_redirect_url, sign
+
+    create_db()
+    init_default_buttons()
+    secret = b'bench-secret'
+    button_ids = [get_button_config(name)['id'] for name in DEFAULT_BUTTONS]
+    paths = [(button_id, 1000 + i, sign(secret, button_id, 1000 + i))
+             for i, button_id in enumerate(button_ids * 20)]
+
+    recorder = ClickRecorder()
+    recorder.start()
+    await bench_handler(create_redirect_app(secret, recorder), paths, count)
+
+    port = 18080
+    runner = await start_redirect_server(secret, '127.0.0.1', port, recorder)
+    urls = [build_redirect_url(f'http://127.0.0.1:{port}', secret, button_id, user_id)
+            for button_id, user_id, _ in paths]
+    try:
+        await bench_http(urls, count, concurrency)
+    finally:
+        await runner.cleanup()
+        await recorder.stop()
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    parallel = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(main(total, parallel))
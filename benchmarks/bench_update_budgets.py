@@ -0,0 +1,122 @@
+"""
+Проверка бюджетов обращений на горячих путях: /start (новый и повторный
+пользователь), кнопки меню и админ-панель. Каждое обновление прогоняется
+через диспетчер bot.py с фиктивной HTTP-сессией (Bot API не вызывается по
+сети) и временной БД SQLite; счетчики SQL-запросов, транзакций и вызовов
+API сравниваются с бюджетом, объявленным через @budget.
+
+Запуск: python benchmarks/bench_update_budgets.py
+Код возврата 1, если какой-либо обработчик превысил бюджет.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN_ID = 635124229
+
+
+def make_fake_session():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Message
+
+    class FakeSession(BaseSession):
+        """Отвечает на любой метод Bot API без обращения к сети"""
+
+        async def make_request(self, bot, method, timeout=None):
+            if method.__returning__ is bool:
+                return True
+            return Message(message_id=1, date=datetime.now(), chat={'id': 1, 'type': 'private'}, text='ok')
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b''
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+def message_update(update_id: int, user_id: int, text: str):
+    from aiogram.types import Update
+
+    entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else None
+    return Update.model_validate({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': text, 'entities': entities,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест', 'username': f'user{user_id}'},
+    }})
+
+
+async def run_scenarios():
+    import bot
+    from button_config import DEFAULT_BUTTONS
+    from update_metrics import COUNTERS, update_metrics
+
+    session = make_fake_session()
+    session.middleware(update_metrics.request_middleware)
+    tenant_bot = bot.bots[bot.DEFAULT_TENANT]
+    tenant_bot.session = session
+
+    bot.create_db()
+    bot.init_default_buttons()
+    update_metrics.reset()
+
+    scenarios = [
+        ('/start, новый пользователь', 'command_start_handler', 1001, '/start'),
+        ('/start, повторный', 'command_start_handler', 1001, '/start'),
+        ('/start, администратор', 'command_start_handler', ADMIN_ID, '/start'),
+    ]
+    handlers = {
+        'support': 'support_handler', 'contest': 'contest_handler', 'videos': 'videos_handler',
+        'catalog': 'catalog_handler', 'channel': 'telegram_channel_handler',
+    }
+    for name, button in DEFAULT_BUTTONS.items():
+        scenarios.append((f"кнопка {name}", handlers[name], 1001, button['button_text']))
+    scenarios.append(('админ-панель', 'admin_panel_handler', ADMIN_ID, '👨‍💻 Админ-панель'))
+
+    failures = 0
+    print(f"{'сценарий':<30} {'обработчик':<26} {'SQL':>5} {'TX':>5} {'API':>5}  бюджет")
+    for update_id, (title, expected, user_id, text) in enumerate(scenarios, start=1):
+        update_metrics.last = None
+        await bot.dp.feed_update(tenant_bot, message_update(update_id, user_id, text))
+        counters = update_metrics.last
+
+        if counters is None or counters.handler != expected:
+            print(f"{title:<30} ожидался {expected}, обработано: {counters.handler if counters else 'ничем'}")
+            failures += 1
+            continue
+        if counters.budget is None:
+            print(f"{title:<30} у {expected} не объявлен бюджет")
+            failures += 1
+            continue
+
+        limits = "/".join('-' if getattr(counters.budget, c) is None else str(getattr(counters.budget, c))
+                          for c in COUNTERS)
+        exceeded = counters.over_budget()
+        status = "ПРЕВЫШЕН: " + ", ".join(exceeded) if exceeded else "ok"
+        print(f"{title:<30} {expected:<26} {counters.sql:>5} {counters.transactions:>5} "
+              f"{counters.api_calls:>5}  {limits} {status}")
+        failures += bool(exceeded)
+
+    await bot.click_recorder.flush()
+    return failures
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ['BOT_TOKEN'] = '123456:FAKE-TOKEN'
+        os.environ.pop('TENANTS', None)
+        failures = asyncio.run(run_scenarios())
+    print("Все бюджеты соблюдены" if not failures else f"Нарушений: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,38 @@
 import asyncio
+import hashlib
+import html
 import logging
 import os
-from typing import List
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import ConfigDict
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import CommandStart, Command
-from aiogram.types import InlineKeyboardButton, Message, FSInputFile, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import InlineKeyboardButton, Message, FSInputFile, BufferedInputFile, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy.orm import sessionmaker
 from db.engine import engine, create_db
-from db.models import User, Linktr
+from db.migrations import migrate_link_clicks
+from db.snapshot import analytics
+from db.models import ButtonLinkVersion, User, Linktr, DEFAULT_TENANT
 from export_to_excel import export_full_data_to_excel   # Убедитесь, что этот модуль существует
+from export_cache import export_cache
+from daily_reports import UNKNOWN_LINK, DailyReportScheduler, format_report, format_reports_summary, load_reports
 from datetime import datetime
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from button_config import get_button_config, init_default_buttons, get_buttons_summary, update_button_config
+from logging_setup import setup_logging, ACTIVITY_LOGGER
+from click_pipeline import click_recorder
+from activity import backfill_activity, needs_backfill, upsert_user
+from cohorts import cohort_engine, format_cohorts
+from click_redirect import build_redirect_url, start_redirect_server
+from profiling import Profiler
+from update_metrics import METRICS_LOGGER, budget, update_metrics
+from activity_browser import ClicksPage, fetch_clicks_page, format_clicks_page, build_clicks_keyboard
 
 
 class EditLinkStates(StatesGroup):
@@ -27,9 +43,38 @@ class EditLinkStates(StatesGroup):
 
 
 class Settings(BaseSettings):
-    bot_token: str   # Значение по умолчанию
+    bot_token: Optional[str] = None  # Токен единственного бота (бренд "default")
     admin_ids: List[int] = [635124229, 8199226208]  # Значение по умолчанию
 
+    # Несколько ботов в одном процессе: {"бренд": "токен"}, JSON в переменной TENANTS
+    tenants: Dict[str, str] = {}
+    tenant_admin_ids: Dict[str, List[int]] = {}  # Свои администраторы бренда вместо admin_ids
+
+    # Логирование
+    log_level: str = "INFO"
+    log_json: bool = False  # JSON-строки вместо текстового формата
+    log_file: Optional[str] = None
+    log_activity_sample_rate: float = 1.0  # Доля сохраняемых сообщений о действиях пользователей
+    log_metrics_sample_rate: float = 1.0  # Доля сохраняемых счетчиков обращений по обновлениям
+
+    # Учет реальных переходов через короткие ссылки
+    redirect_base_url: Optional[str] = None  # Публичный адрес сервера редиректов, без него ссылки прямые
+    redirect_host: str = "0.0.0.0"
+    redirect_port: int = 8080
+    redirect_secret: Optional[str] = None  # Обязателен при нескольких брендах; иначе выводится из токена бота
+
+    # Аналитика читает из периодически обновляемого снимка БД
+    analytics_refresh_interval: int = 300  # Секунды между обновлениями снимка
+    analytics_snapshot_path: str = "db_snapshot.sqlite3"
+    analytics_database_url: Optional[str] = None  # Реплика для чтения (например, Postgres)
+
+    # Кэш выгрузок Excel
+    export_cache_dir: str = "exports_cache"
+    export_cache_max_mb: int = 200
+
+    # Час (по времени сервера), в который считаются и рассылаются ежедневные отчеты
+    daily_report_hour: int = 3
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -38,49 +83,106 @@ class Settings(BaseSettings):
 
 
 settings = Settings()
-bot = Bot(
-    token=settings.bot_token,
-    default=DefaultBotProperties(parse_mode="HTML")
-)
+tenant_tokens = settings.tenants or {DEFAULT_TENANT: settings.bot_token}
+if not all(tenant_tokens.values()):
+    raise RuntimeError("Не задан BOT_TOKEN или TENANTS")
+
+# Одна HTTP-сессия на все боты: общий пул соединений к Bot API
+http_session = AiohttpSession()
+bots = {
+    tenant: Bot(token=token, session=http_session, default=DefaultBotProperties(parse_mode="HTML"))
+    for tenant, token in tenant_tokens.items()
+}
+tenant_by_bot_id = {tenant_bot.id: tenant for tenant, tenant_bot in bots.items()}
 dp = Dispatcher()
 
+
+@dp.update.outer_middleware()
+async def tenant_middleware(handler, event, data):
+    """Бренд определяется по боту, принявшему обновление"""
+    data['tenant'] = tenant_by_bot_id[data['bot'].id]
+    return await handler(event, data)
+
+
+profiler = Profiler(dp)
+# Счетчики SQL, транзакций и вызовов Bot API на каждое обновление
+update_metrics.install(dp, http_session)
+
+analytics.snapshot_path = settings.analytics_snapshot_path
+analytics.set_replica_url(settings.analytics_database_url)
+export_cache.directory = settings.export_cache_dir
+export_cache.max_bytes = settings.export_cache_max_mb * 1024 * 1024
+
 Session = sessionmaker(bind=engine)
+activity_log = logging.getLogger(ACTIVITY_LOGGER)
+if settings.redirect_secret:
+    redirect_secret = settings.redirect_secret.encode()
+elif settings.redirect_base_url and len(tenant_tokens) > 1:
+    # Ключ из токена «первого» бренда сменился бы при изменении порядка или состава TENANTS,
+    # и все уже отправленные ссылки перестали бы открываться
+    raise RuntimeError("При нескольких брендах и REDIRECT_BASE_URL нужно задать REDIRECT_SECRET")
+else:
+    # Без явного секрета подпись привязана к токену единственного бота
+    redirect_secret = hashlib.sha256(b"redirect:" + next(iter(tenant_tokens.values())).encode()).digest()
+
+
+def is_admin(user_id: int, tenant: str) -> bool:
+    """Является ли пользователь администратором бренда"""
+    return user_id in settings.tenant_admin_ids.get(tenant, settings.admin_ids)
+
+
+def is_global_admin(user_id: int) -> bool:
+    """Администратор всего процесса: профилирование затрагивает все бренды сразу"""
+    return user_id in settings.admin_ids
+
+
+def log_task_exception(task: asyncio.Task):
+    """done-callback фоновой задачи: ошибка сразу попадает в лог, а не при сборке мусора"""
+    if not task.cancelled() and task.exception():
+        logging.error("Фоновая задача %s завершилась с ошибкой", task.get_name(), exc_info=task.exception())
+
 
+# Ссылки на задачи, запущенные из обработчиков: иначе event loop может удалить их до завершения
+background_tasks = set()
 
-def add_user_to_db(user_id: int, username: str | None, first_name: str | None, last_name: str | None):
-    """Добавление или обновление пользователя в БД"""
+
+def start_background_task(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    task.add_done_callback(log_task_exception)
+    return task
+
+
+def add_user_to_db(tenant: str, user_id: int, username: str | None, first_name: str | None, last_name: str | None):
+    """Добавление или обновление пользователя в БД одним запросом; /start отмечается в активности за день"""
+    now = datetime.now()
     with Session() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            new_user = User(
-                user_id=user_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name
-            )
-            session.add(new_user)
-            logging.info(f"Новый пользователь добавлен: {user_id}")
-        else:
-            # Обновляем данные пользователя
-            user.username = username
-            user.first_name = first_name
-            user.last_name = last_name
-            logging.info(f"Данные пользователя обновлены: {user_id}")
+        is_new = upsert_user(session, tenant, user_id, username, first_name, last_name, now)
         session.commit()
+    click_recorder.record_start(user_id, tenant, now)
+    if is_new:
+        activity_log.info("Новый пользователь добавлен: %s", user_id)
+    else:
+        activity_log.info("Данные пользователя обновлены: %s", user_id)
 
-def add_link_click(user_id: int, link: str):
+def add_link_click(user_id: int, config: dict, tenant: str):
     """
-    Добавляет запись о переходе по ссылке в таблицу linktr
+    Добавляет запись о переходе по ссылке в таблицу linktr (через пакетный буфер)
     """
-    with Session() as session:
-        new_click = Linktr(
-            user_id=user_id,
-            link=link,
-            created_at=datetime.now()
-        )
-        session.add(new_click)
-        session.commit()
-        logging.info(f"Сохранен переход пользователя {user_id} по ссылке: {link}")
+    click_recorder.record(user_id, config, tenant)
+    activity_log.info("Сохранен переход пользователя %s по ссылке: %s", user_id, config['url'])
+
+def tracked_url(user_id: int, config: dict, tenant: str) -> str:
+    """
+    URL для inline-кнопки. Если настроен сервер редиректов, возвращает короткую
+    подписанную ссылку и переход записывается при реальном открытии.
+    Иначе переход записывается сразу, как раньше.
+    """
+    if settings.redirect_base_url and config.get('id'):
+        return build_redirect_url(settings.redirect_base_url, redirect_secret, config['id'], user_id)
+    add_link_click(user_id, config, tenant)
+    return config['url']
 
 async def answer_html(message: Message, text: str, reply_markup=None):
     """Ответ с HTML разметкой"""
@@ -91,7 +193,7 @@ async def answer_html(message: Message, text: str, reply_markup=None):
             parse_mode="HTML"
         )
     except Exception as e:
-        logging.error(f"Ошибка HTML: {e}")
+        logging.error("Ошибка HTML: %s", e)
         # Отправляем без форматирования
         return await message.answer(
             text=text.replace('<b>', '').replace('</b>', ''),
@@ -99,11 +201,13 @@ async def answer_html(message: Message, text: str, reply_markup=None):
         )
 
 @dp.message(CommandStart())
-async def command_start_handler(message: Message) -> None:
+@budget(sql=1, transactions=1, api_calls=1)
+async def command_start_handler(message: Message, tenant: str) -> None:
     """Обработчик команды /start"""
     user = message.from_user
 
     add_user_to_db(
+        tenant=tenant,
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
@@ -111,11 +215,11 @@ async def command_start_handler(message: Message) -> None:
     )
 
 
-    support_config = get_button_config('support')
-    contest_config = get_button_config('contest')
-    videos_config = get_button_config('videos')
-    catalog_config = get_button_config('catalog')
-    channel_config = get_button_config('channel')
+    support_config = get_button_config('support', tenant)
+    contest_config = get_button_config('contest', tenant)
+    videos_config = get_button_config('videos', tenant)
+    catalog_config = get_button_config('catalog', tenant)
+    channel_config = get_button_config('channel', tenant)
 
     # Создаем клавиатуру
     kb = [
@@ -126,7 +230,7 @@ async def command_start_handler(message: Message) -> None:
         [KeyboardButton(text=channel_config['button_text'] if channel_config else "📢 Наш телеграм канал")]
     ]
 
-    if user.id in settings.admin_ids:
+    if is_admin(user.id, tenant):
         kb.append([KeyboardButton(text="👨‍💻 Админ-панель")])
 
     keyboard = ReplyKeyboardMarkup(
@@ -143,16 +247,16 @@ async def command_start_handler(message: Message) -> None:
     )
 
 @dp.message(lambda message: message.text in ["📝 Написать в поддержку", "Написать в поддержку"])
-async def support_handler(message: Message):
+@budget(sql=0, transactions=0, api_calls=1)
+async def support_handler(message: Message, tenant: str):
     user = message.from_user.id
-    config = get_button_config('support')
-    link = config['url']
+    config = get_button_config('support', tenant)
 
     if not config:
         await message.answer("❌ Ссылка временно недоступна")
         return
 
-    add_link_click(user, link)
+    link = tracked_url(user, config, tenant)
     """Обработчик для поддержки"""
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(
@@ -169,12 +273,11 @@ async def support_handler(message: Message):
 
 
 @dp.message(lambda message: message.text in ["🎁 Конкурс с крутыми призами", "Конкурс с крутыми призами"])
-async def contest_handler(message: Message):
+@budget(sql=0, transactions=0, api_calls=1)
+async def contest_handler(message: Message, tenant: str):
     user = message.from_user.id
-    config = get_button_config('contest')
-    link = config['url']
-
-    add_link_click(user, link)
+    config = get_button_config('contest', tenant)
+    link = tracked_url(user, config, tenant)
     """Обработчик для конкурса"""
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(
@@ -191,12 +294,11 @@ async def contest_handler(message: Message):
 
 
 @dp.message(lambda message: message.text in ["🎬 Ролики по работе с гравером", "Ролики по работе с гравером"])
-async def videos_handler(message: Message):
+@budget(sql=0, transactions=0, api_calls=1)
+async def videos_handler(message: Message, tenant: str):
     user = message.from_user.id
-    config = get_button_config('videos')
-    link = config['url']
-
-    add_link_click(user, link)
+    config = get_button_config('videos', tenant)
+    link = tracked_url(user, config, tenant)
     """Обработчик для видео"""
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(
@@ -216,12 +318,11 @@ async def videos_handler(message: Message):
 
 
 @dp.message(lambda message: message.text in ["🛍 Каталог товаров", "Каталог товаров"])
-async def catalog_handler(message: Message):
+@budget(sql=0, transactions=0, api_calls=1)
+async def catalog_handler(message: Message, tenant: str):
     user = message.from_user.id
-    config = get_button_config('catalog')
-    link = config['url']
-
-    add_link_click(user, link)
+    config = get_button_config('catalog', tenant)
+    link = tracked_url(user, config, tenant)
     """Обработчик для каталога"""
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(
@@ -241,12 +342,11 @@ async def catalog_handler(message: Message):
 
 
 @dp.message(lambda message: message.text in ["📢 Наш телеграм канал", "Наш телеграм канал"])
-async def telegram_channel_handler(message: Message):
+@budget(sql=0, transactions=0, api_calls=1)
+async def telegram_channel_handler(message: Message, tenant: str):
     user = message.from_user.id
-    config = get_button_config('channel')
-    link = config['url']
-
-    add_link_click(user, link)
+    config = get_button_config('channel', tenant)
+    link = tracked_url(user, config, tenant)
     """Обработчик для Telegram канала"""
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(
@@ -266,9 +366,10 @@ async def telegram_channel_handler(message: Message):
 
 
 @dp.message(lambda message: message.text in ["👨‍💻 Админ-панель", "Админ-панель"])
-async def admin_panel_handler(message: Message):
+@budget(sql=0, transactions=0, api_calls=1)
+async def admin_panel_handler(message: Message, tenant: str):
     """Админ-панель"""
-    if message.from_user.id not in settings.admin_ids:
+    if not is_admin(message.from_user.id, tenant):
         await message.answer("⛔ У вас нет прав для доступа к админ-панели.")
         return
 
@@ -286,10 +387,27 @@ async def admin_panel_handler(message: Message):
         text="📈 Статистика переходов",
         callback_data="link_stats"
     ))
+    builder.row(InlineKeyboardButton(
+        text="🗓 Ежедневные отчеты",
+        callback_data="daily_reports"
+    ))
+    builder.row(InlineKeyboardButton(
+        text="👥 Когорты",
+        callback_data="cohorts"
+    ))
+    builder.row(InlineKeyboardButton(
+        text="🕘 Последние переходы",
+        callback_data="recent_clicks"
+    ))
     builder.row(InlineKeyboardButton(
         text="🔗 Управление ссылками",
         callback_data="manage_links"
     ))
+    if is_global_admin(message.from_user.id):
+        builder.row(InlineKeyboardButton(
+            text="🔬 Профилирование",
+            callback_data="profiling"
+        ))
 
     await answer_html(
         message,
@@ -297,22 +415,23 @@ async def admin_panel_handler(message: Message):
         "<b>Доступные команды:</b>\n"
         "• Экспорт данных в Excel\n"
         "• Просмотр статистики\n"
+        "• Последние переходы (/clicks ID — по пользователю)\n"
         "• Управление ссылками\n\n"
         "<i>Выберите действие:</i>",
         reply_markup=builder.as_markup()
     )
 
 @dp.callback_query(lambda c: c.data == "manage_links")
-async def manage_links_callback(callback_query: types.CallbackQuery, state: FSMContext):
+async def manage_links_callback(callback_query: types.CallbackQuery, state: FSMContext, tenant: str):
     """Управление ссылками"""
-    if callback_query.from_user.id not in settings.admin_ids:
+    if not is_admin(callback_query.from_user.id, tenant):
         await callback_query.answer("⛔ Нет доступа", show_alert=True)
         return
 
     await callback_query.answer()
 
     # Показываем текущие настройки
-    summary = get_buttons_summary()
+    summary = get_buttons_summary(tenant)
 
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(
@@ -349,9 +468,9 @@ async def manage_links_callback(callback_query: types.CallbackQuery, state: FSMC
 
 
 @dp.callback_query(lambda c: c.data.startswith("edit_"))
-async def edit_link_callback(callback_query: types.CallbackQuery, state: FSMContext):
+async def edit_link_callback(callback_query: types.CallbackQuery, state: FSMContext, tenant: str):
     """Начало процесса редактирования ссылки"""
-    if callback_query.from_user.id not in settings.admin_ids:
+    if not is_admin(callback_query.from_user.id, tenant):
         await callback_query.answer("⛔ Нет доступа", show_alert=True)
         return
 
@@ -368,7 +487,7 @@ async def edit_link_callback(callback_query: types.CallbackQuery, state: FSMCont
 
 
 @dp.message(EditLinkStates.entering_new_url)
-async def process_new_url(message: Message, state: FSMContext):
+async def process_new_url(message: Message, state: FSMContext, tenant: str):
     """Обработка нового URL"""
     if message.text.lower() == 'отмена':
         await state.clear()
@@ -386,7 +505,7 @@ async def process_new_url(message: Message, state: FSMContext):
     button_name = data.get('button_name')
 
     # Получаем текущую конфигурацию для показа
-    config = get_button_config(button_name)
+    config = get_button_config(button_name, tenant)
 
     await message.answer(
         f"Текущий текст кнопки: {config['button_text'] if config else 'Не найден'}\n"
@@ -396,7 +515,7 @@ async def process_new_url(message: Message, state: FSMContext):
 
 
 @dp.message(EditLinkStates.entering_new_text)
-async def process_new_text(message: Message, state: FSMContext):
+async def process_new_text(message: Message, state: FSMContext, tenant: str):
     """Обработка нового текста кнопки"""
     data = await state.get_data()
     button_name = data.get('button_name')
@@ -408,7 +527,7 @@ async def process_new_text(message: Message, state: FSMContext):
     else:
         # Сохраняем изменения без изменения текста
         admin_id = message.from_user.id
-        success = update_button_config(button_name, new_url, admin_id)
+        success = update_button_config(button_name, new_url, admin_id, tenant=tenant)
 
         if success:
             await message.answer("✅ Ссылка успешно обновлена!")
@@ -419,7 +538,7 @@ async def process_new_text(message: Message, state: FSMContext):
 
 
 @dp.message(EditLinkStates.confirming)
-async def confirm_new_text(message: Message, state: FSMContext):
+async def confirm_new_text(message: Message, state: FSMContext, tenant: str):
     """Подтверждение нового текста"""
     data = await state.get_data()
     button_name = data.get('button_name')
@@ -427,7 +546,7 @@ async def confirm_new_text(message: Message, state: FSMContext):
     new_text = message.text
 
     admin_id = message.from_user.id
-    success = update_button_config(button_name, new_url, admin_id, new_text)
+    success = update_button_config(button_name, new_url, admin_id, new_text, tenant=tenant)
 
     if success:
         await message.answer("✅ Ссылка и текст кнопки успешно обновлены!")
@@ -438,9 +557,9 @@ async def confirm_new_text(message: Message, state: FSMContext):
 
 
 @dp.callback_query(lambda c: c.data == "back_to_admin")
-async def back_to_admin_callback(callback_query: types.CallbackQuery):
+async def back_to_admin_callback(callback_query: types.CallbackQuery, tenant: str):
     """Возврат в админ-панель"""
-    if callback_query.from_user.id not in settings.admin_ids:
+    if not is_admin(callback_query.from_user.id, tenant):
         await callback_query.answer("⛔ Нет доступа", show_alert=True)
         return
 
@@ -460,10 +579,27 @@ async def back_to_admin_callback(callback_query: types.CallbackQuery):
         text="📊 Статистика переходов",
         callback_data="link_stats"
     ))
+    builder.row(InlineKeyboardButton(
+        text="🗓 Ежедневные отчеты",
+        callback_data="daily_reports"
+    ))
+    builder.row(InlineKeyboardButton(
+        text="👥 Когорты",
+        callback_data="cohorts"
+    ))
+    builder.row(InlineKeyboardButton(
+        text="🕘 Последние переходы",
+        callback_data="recent_clicks"
+    ))
     builder.row(InlineKeyboardButton(
         text="🔗 Управление ссылками",
         callback_data="manage_links"
     ))
+    if is_global_admin(callback_query.from_user.id):
+        builder.row(InlineKeyboardButton(
+            text="🔬 Профилирование",
+            callback_data="profiling"
+        ))
 
     await callback_query.message.answer(
         "👨‍💻 <b>Административная панель</b>\n\n"
@@ -474,84 +610,280 @@ async def back_to_admin_callback(callback_query: types.CallbackQuery):
 
 
 @dp.callback_query(lambda c: c.data == "export_data")
-async def export_users_callback(callback_query: types.CallbackQuery):
+async def export_users_callback(callback_query: types.CallbackQuery, tenant: str, bot: Bot):
     """Обработчик для экспорта данных"""
-    if callback_query.from_user.id not in settings.admin_ids:
+    if not is_admin(callback_query.from_user.id, tenant):
         await callback_query.answer("⛔ Нет доступа", show_alert=True)
         return
 
     await callback_query.answer()
-    await callback_query.message.answer("⏳ Начинаю выгрузку данных...")
 
-    filename = export_full_data_to_excel()
+    try:
+        await send_full_export(callback_query, tenant, bot)
+    except Exception as e:
+        logging.error("Не удалось выгрузить данные бренда %s: %s", tenant, e)
+        await callback_query.message.answer(f"❌ Не удалось отправить файл: {e}")
+
+
+async def send_full_export(callback_query: types.CallbackQuery, tenant: str, bot: Bot):
+    """Отправка полной выгрузки: сохраненный file_id, файл из кэша или новая выгрузка"""
+    # Выгрузка строится из снимка: пока в нем нет новых данных, отдаем готовый файл
+    version = await asyncio.to_thread(export_cache.data_version, tenant)
+    entry = await asyncio.to_thread(export_cache.lookup, tenant, 'full', version)
 
-    if filename and os.path.exists(filename):
+    if entry and entry['file_id']:
         try:
             await bot.send_document(
                 callback_query.from_user.id,
-                document=FSInputFile(filename),
+                document=entry['file_id'],
                 caption="📊 Выгрузка данных завершена"
             )
-        except Exception as e:
-            await callback_query.message.answer(f"❌ Не удалось отправить файл: {e}")
-        finally:
-            # Удаляем файл после отправки
-            try:
-                os.remove(filename)
-                logging.info(f"Файл {filename} удален")
-            except:
-                pass
-    else:
-        await callback_query.message.answer("❌ Не удалось создать файл для выгрузки.")
+            return
+        except TelegramBadRequest as e:
+            logging.warning("Сохраненный file_id выгрузки не принят: %s", e)
+            export_cache.forget_file_id(tenant, 'full')
+            if not os.path.exists(entry['path']):
+                entry = None
+
+    if entry is None:
+        await callback_query.message.answer("⏳ Начинаю выгрузку данных...")
+        filename = await asyncio.to_thread(export_full_data_to_excel, tenant)
+        if not filename or not os.path.exists(filename):
+            await callback_query.message.answer("❌ Не удалось создать файл для выгрузки.")
+            return
+        entry = await asyncio.to_thread(export_cache.store, tenant, 'full', version, filename)
+
+    sent = await bot.send_document(
+        callback_query.from_user.id,
+        document=FSInputFile(entry['path'], filename=entry['filename']),
+        caption="📊 Выгрузка данных завершена"
+    )
+    export_cache.remember_file_id(tenant, 'full', version, sent.document.file_id)
 
 
 @dp.callback_query(lambda c: c.data == "link_stats")
-async def link_stats_callback(callback_query: types.CallbackQuery):
+async def link_stats_callback(callback_query: types.CallbackQuery, tenant: str):
     """Обработчик для статистики переходов по ссылкам"""
-    if callback_query.from_user.id not in settings.admin_ids:
+    if not is_admin(callback_query.from_user.id, tenant):
         await callback_query.answer("⛔ Нет доступа", show_alert=True)
         return
 
     await callback_query.answer()
 
-    # Получаем статистику из БД
-    with Session() as session:
-        total_users = session.query(User).count()
-        total_clicks = session.query(Linktr).count()
+    # Получаем статистику из снимка БД
+    with analytics.session() as session:
+        total_users = session.query(User).filter(User.tenant == tenant).count()
+        total_clicks = session.query(Linktr).filter(Linktr.tenant == tenant).count()
 
-        # Статистика по каждой ссылке
-        from sqlalchemy import func
+        # Статистика по ссылке на момент перехода (версия кнопки), как в выгрузке и ежедневных отчетах;
+        # старые несопоставленные записи — по исходному URL
+        from sqlalchemy import and_, func
+        link = func.coalesce(ButtonLinkVersion.url, Linktr.link)
         link_stats = session.query(
-            Linktr.link,
+            link,
             func.count(Linktr.id).label('click_count'),
             func.count(func.distinct(Linktr.user_id)).label('unique_users')
-        ).group_by(Linktr.link).all()
+        ).outerjoin(
+            ButtonLinkVersion,
+            and_(ButtonLinkVersion.button_id == Linktr.button_id, ButtonLinkVersion.version == Linktr.link_version)
+        ).filter(Linktr.tenant == tenant).group_by(link).all()
 
     stats_text = "📊 <b>Статистика переходов:</b>\n\n"
     stats_text += f"👥 Всего пользователей: {total_users}\n"
     stats_text += f"🖱 Всего переходов: {total_clicks}\n\n"
     stats_text += "<b>По ссылкам:</b>\n"
 
-    for link, clicks, unique_users in link_stats:
-        stats_text += f"• {link}: {clicks} переходов (уникальных: {unique_users})\n"
+    for url, clicks, unique_users in link_stats:
+        stats_text += f"• {html.escape(url or UNKNOWN_LINK)}: {clicks} переходов (уникальных: {unique_users})\n"
 
     await callback_query.message.answer(
         stats_text,
         parse_mode="HTML"
     )
 
+@dp.callback_query(lambda c: c.data == "daily_reports")
+async def daily_reports_callback(callback_query: types.CallbackQuery, tenant: str):
+    """Сохраненные ежедневные отчеты за последнюю неделю"""
+    if not is_admin(callback_query.from_user.id, tenant):
+        await callback_query.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    await callback_query.answer()
+
+    with analytics.session() as session:
+        reports = load_reports(session, tenant, limit=7)
+
+    if not reports:
+        await callback_query.message.answer("🗓 Ежедневных отчетов пока нет.")
+        return
+
+    await callback_query.message.answer(
+        format_reports_summary(reports) + "\n\n" + format_report(reports[-1]),
+        parse_mode="HTML"
+    )
+
+
+@dp.callback_query(lambda c: c.data == "cohorts")
+async def cohorts_callback(callback_query: types.CallbackQuery, tenant: str):
+    """Удержание недельных когорт и воронки по кнопкам (из снимка БД)"""
+    if not is_admin(callback_query.from_user.id, tenant):
+        await callback_query.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    await callback_query.answer()
+    retention_df, funnels_df = await asyncio.to_thread(cohort_engine.report, tenant)
+    await callback_query.message.answer(format_cohorts(retention_df, funnels_df), parse_mode="HTML")
+
+
+async def send_daily_report(tenant: str, report: Dict) -> int:
+    """Рассылка ежедневного отчета администраторам бренда; возвращает число успешных отправок"""
+    text = format_report(report)
+    delivered = 0
+    for admin_id in settings.tenant_admin_ids.get(tenant, settings.admin_ids):
+        try:
+            await bots[tenant].send_message(admin_id, text, parse_mode="HTML")
+            delivered += 1
+        except Exception as e:
+            logging.warning("Не удалось отправить отчет администратору %s: %s", admin_id, e)
+    return delivered
+
+
+def render_clicks_page(page: ClicksPage, tenant: str):
+    """Текст и клавиатура страницы последних переходов (из снимка БД)"""
+    with analytics.session() as session:
+        rows, has_more = fetch_clicks_page(session, page, tenant)
+    snapshot_time = datetime.fromtimestamp(analytics.refreshed_at) if analytics.refreshed_at else None
+    return format_clicks_page(rows, page, snapshot_time), build_clicks_keyboard(rows, page, has_more, tenant)
+
+
+@dp.callback_query(lambda c: c.data == "recent_clicks")
+async def recent_clicks_callback(callback_query: types.CallbackQuery, tenant: str):
+    """Первая страница последних переходов"""
+    if not is_admin(callback_query.from_user.id, tenant):
+        await callback_query.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    await callback_query.answer()
+    text, keyboard = render_clicks_page(ClicksPage(), tenant)
+    await callback_query.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@dp.message(Command("clicks"))
+async def user_clicks_command(message: Message, tenant: str):
+    """Последние переходы конкретного пользователя: /clicks <user_id>"""
+    if not is_admin(message.from_user.id, tenant):
+        return
+
+    parts = message.text.split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        await message.answer("Использование: /clicks &lt;ID пользователя&gt;")
+        return
+
+    text, keyboard = render_clicks_page(ClicksPage(u=int(parts[1])), tenant)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@dp.message(Command("metrics"))
+async def metrics_command(message: Message, tenant: str):
+    """Счетчики SQL-запросов, транзакций и вызовов API по обработчикам с момента запуска"""
+    if not is_admin(message.from_user.id, tenant):
+        return
+
+    if not update_metrics.stats:
+        await message.answer("📏 Обновлений еще не было.")
+        return
+
+    await message.answer(
+        "📏 <b>Обращения на одно обновление</b> (среднее/максимум/бюджет)\n\n"
+        f"<pre>{html.escape(update_metrics.report())}</pre>",
+        parse_mode="HTML"
+    )
+
+
+@dp.callback_query(ClicksPage.filter())
+async def clicks_page_callback(callback_query: types.CallbackQuery, callback_data: ClicksPage, tenant: str):
+    """Навигация по переходам: сообщение редактируется на месте"""
+    if not is_admin(callback_query.from_user.id, tenant):
+        await callback_query.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    await callback_query.answer()
+    text, keyboard = render_clicks_page(callback_data, tenant)
+    try:
+        await callback_query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    except TelegramBadRequest:
+        # Содержимое не изменилось (например, повторное нажатие «Все»)
+        pass
+
+
+@dp.callback_query(lambda c: c.data == "profiling")
+async def profiling_callback(callback_query: types.CallbackQuery):
+    """Выбор длительности профилирования"""
+    if not is_global_admin(callback_query.from_user.id):
+        await callback_query.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    await callback_query.answer()
+
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="30 сек", callback_data="profile_30"),
+        InlineKeyboardButton(text="1 мин", callback_data="profile_60"),
+        InlineKeyboardButton(text="5 мин", callback_data="profile_300")
+    )
+    await callback_query.message.answer(
+        "🔬 <b>Профилирование</b>\n\n"
+        "Время обработчиков, задержка event loop, горячие точки и SQL-запросы. "
+        "Отчет придет файлом.\n\n"
+        "<i>Выберите длительность:</i>",
+        reply_markup=builder.as_markup(),
+        parse_mode="HTML"
+    )
+
+
+async def send_profile_report(bot: Bot, chat_id: int, duration: int):
+    """Профилирование и отправка отчета администратору"""
+    report = await profiler.finish_after(duration)
+    await bot.send_document(
+        chat_id,
+        document=BufferedInputFile(
+            report.encode("utf-8"),
+            filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        ),
+        caption=f"🔬 Профиль за {duration} сек"
+    )
+
+
+@dp.callback_query(lambda c: c.data.startswith("profile_"))
+async def start_profiling_callback(callback_query: types.CallbackQuery, bot: Bot):
+    """Запуск профилирования на выбранное время"""
+    if not is_global_admin(callback_query.from_user.id):
+        await callback_query.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    if profiler.active:
+        await callback_query.answer("⏳ Профилирование уже запущено", show_alert=True)
+        return
+
+    duration = int(callback_query.data.replace("profile_", ""))
+    profiler.start()
+    await callback_query.answer()
+    await callback_query.message.answer(f"⏳ Профилирование запущено на {duration} сек...")
+    start_background_task(send_profile_report(bot, callback_query.from_user.id, duration), name="profile_report")
+
+
 @dp.callback_query(lambda c: c.data == "stats")
-async def stats_callback(callback_query: types.CallbackQuery):
+async def stats_callback(callback_query: types.CallbackQuery, tenant: str):
     """Обработчик для статистики"""
-    if callback_query.from_user.id not in settings.admin_ids:
+    if not is_admin(callback_query.from_user.id, tenant):
         await callback_query.answer("⛔ Нет доступа", show_alert=True)
         return
 
     await callback_query.answer()
 
-    # Получаем статистику из БД
-    with Session() as session:
-        total_users = session.query(User).count()
+    # Получаем статистику из снимка БД
+    with analytics.session() as session:
+        total_users = session.query(User).filter(User.tenant == tenant).count()
 
     await callback_query.message.answer(
         f"📈 <b>Статистика бота</b>\n\n"
@@ -567,20 +899,61 @@ async def main() -> None:
     # Создаем базу данных
     create_db()
 
-    init_default_buttons()
+    for tenant in bots:
+        init_default_buttons(tenant)
 
     logging.info("База данных инициализирована")
     logging.info("Кнопки по умолчанию настроены")
 
 
+    # Перевод старых переходов на button_id порциями, не блокируя запуск,
+    # затем однократное восстановление активности пользователей по истории переходов
+    backfill_tenants = [tenant for tenant in bots if needs_backfill(engine, tenant)]
+
+    async def migrate_data():
+        await asyncio.to_thread(migrate_link_clicks, engine)
+        for tenant in backfill_tenants:
+            await asyncio.to_thread(backfill_activity, engine, tenant)
+
+    migration_task = asyncio.create_task(migrate_data(), name="migrate_data")
+    migration_task.add_done_callback(log_task_exception)
+
+    analytics_task = asyncio.create_task(analytics.run_periodic(settings.analytics_refresh_interval))
+
+    # Пропущенные дни досчитываются сразу, дальше — раз в сутки
+    report_scheduler = DailyReportScheduler(bots, send_daily_report, settings.daily_report_hour)
+    report_task = asyncio.create_task(report_scheduler.run())
+
+    click_recorder.start()
+    redirect_runner = None
+    if settings.redirect_base_url:
+        redirect_runner = await start_redirect_server(
+            redirect_secret, settings.redirect_host, settings.redirect_port
+        )
+
     # Запускаем бота
-    logging.info("Бот запущен...")
-    await dp.start_polling(bot)
+    logging.info("Бот запущен, брендов: %d", len(bots))
+    try:
+        await dp.start_polling(*bots.values())
+    finally:
+        analytics_task.cancel()
+        report_task.cancel()
+        if redirect_runner:
+            await redirect_runner.cleanup()
+        await click_recorder.stop()
 
 
 if __name__ == "__main__":
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    log_listener = setup_logging(
+        level=settings.log_level,
+        json_format=settings.log_json,
+        log_file=settings.log_file,
+        sample_rates={
+            ACTIVITY_LOGGER: settings.log_activity_sample_rate,
+            METRICS_LOGGER: settings.log_metrics_sample_rate,
+        }
     )
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
@@ -1,12 +1,16 @@
 # button_config.py
 from sqlalchemy.orm import sessionmaker
 from db.engine import engine
-from db.models import ButtonLink
-from typing import Dict, Optional
+from db.models import ButtonLink, ButtonLinkVersion, DEFAULT_TENANT
+from typing import Dict, List, Optional
 import logging
 
 Session = sessionmaker(bind=engine)
 
+# Кэш активных кнопок всех брендов: заполняется при первом обращении, сбрасывается при изменении
+_cache_by_name: Optional[Dict[str, Dict[str, Dict]]] = None  # tenant -> button_name -> config
+_cache_by_id: Optional[Dict[int, Dict]] = None
+
 # Словарь с настройками кнопок по умолчанию
 DEFAULT_BUTTONS = {
     'support': {
@@ -36,63 +40,125 @@ DEFAULT_BUTTONS = {
     }
 }
 
-def init_default_buttons():
+def init_default_buttons(tenant: str = DEFAULT_TENANT):
     """Инициализация кнопок по умолчанию при первом запуске"""
     with Session() as session:
         for button_name, config in DEFAULT_BUTTONS.items():
-            existing = session.query(ButtonLink).filter(ButtonLink.button_name == button_name).first()
+            existing = session.query(ButtonLink).filter(
+                ButtonLink.tenant == tenant,
+                ButtonLink.button_name == button_name
+            ).first()
             if not existing:
                 new_button = ButtonLink(
+                    tenant=tenant,
                     button_name=button_name,
                     button_text=config['button_text'],
                     url=config['url'],
                     description=config['description'],
-                    is_active=True
+                    is_active=True,
+                    version=1
                 )
                 session.add(new_button)
-                logging.info(f"Создана кнопка по умолчанию: {button_name}")
+                session.flush()
+                session.add(ButtonLinkVersion(
+                    button_id=new_button.id,
+                    version=1,
+                    url=new_button.url,
+                    button_text=new_button.button_text
+                ))
+                logging.info("Создана кнопка по умолчанию: %s (%s)", button_name, tenant)
         session.commit()
+    invalidate_cache()
 
-def get_button_config(button_name: str) -> Optional[Dict]:
-    """Получение конфигурации кнопки по имени"""
+def _button_to_config(button: ButtonLink) -> Dict:
+    return {
+        'id': button.id,
+        'tenant': button.tenant,
+        'button_name': button.button_name,
+        'button_text': button.button_text,
+        'url': button.url,
+        'version': button.version,
+        'description': button.description
+    }
+
+def _load_cache():
+    """Загрузка активных кнопок в память одним запросом"""
+    global _cache_by_name, _cache_by_id
     with Session() as session:
-        button = session.query(ButtonLink).filter(
-            ButtonLink.button_name == button_name,
-            ButtonLink.is_active == True
-        ).first()
+        buttons = session.query(ButtonLink).filter(ButtonLink.is_active == True).all()
+        configs = [_button_to_config(button) for button in buttons]
+    by_name = {}
+    for config in configs:
+        by_name.setdefault(config['tenant'], {})[config['button_name']] = config
+    _cache_by_name = by_name
+    _cache_by_id = {config['id']: config for config in configs}
 
-        if button:
-            return {
-                'button_text': button.button_text,
-                'url': button.url,
-                'description': button.description
-            }
-        # Если кнопка не найдена, возвращаем конфигурацию по умолчанию
-        return DEFAULT_BUTTONS.get(button_name)
+def invalidate_cache():
+    """
+    Перечитывание кэша после изменения кнопок: запрос выполняется сразу,
+    в обработчике администратора, а не в следующем /start пользователя
+    """
+    _load_cache()
 
-def update_button_config(button_name: str, new_url: str, admin_id: int, new_text: str = None) -> bool:
+def get_button_config(button_name: str, tenant: str = DEFAULT_TENANT) -> Optional[Dict]:
+    """Получение конфигурации кнопки по имени"""
+    if _cache_by_name is None:
+        _load_cache()
+    config = _cache_by_name.get(tenant, {}).get(button_name)
+    if config:
+        return config
+    # Если кнопка не найдена, возвращаем конфигурацию по умолчанию
+    return DEFAULT_BUTTONS.get(button_name)
+
+def get_active_buttons(tenant: str = DEFAULT_TENANT) -> List[Dict]:
+    """Список активных кнопок бренда из кэша"""
+    if _cache_by_name is None:
+        _load_cache()
+    return list(_cache_by_name.get(tenant, {}).values())
+
+def get_button_config_by_id(button_id: int) -> Optional[Dict]:
+    """Получение конфигурации активной кнопки по id (для редиректов)"""
+    if _cache_by_id is None:
+        _load_cache()
+    return _cache_by_id.get(button_id)
+
+def update_button_config(button_name: str, new_url: str, admin_id: int, new_text: str = None,
+                         tenant: str = DEFAULT_TENANT) -> bool:
     """Обновление конфигурации кнопки"""
     with Session() as session:
-        button = session.query(ButtonLink).filter(ButtonLink.button_name == button_name).first()
+        button = session.query(ButtonLink).filter(
+            ButtonLink.tenant == tenant,
+            ButtonLink.button_name == button_name
+        ).first()
         if button:
             button.url = new_url
             if new_text:
                 button.button_text = new_text
             button.updated_by = admin_id
+            # Новая версия истории, чтобы старые переходы сохранили прежний URL
+            button.version += 1
+            session.add(ButtonLinkVersion(
+                button_id=button.id,
+                version=button.version,
+                url=button.url,
+                button_text=button.button_text,
+                created_by=admin_id
+            ))
             session.commit()
-            logging.info(f"Кнопка {button_name} обновлена администратором {admin_id}")
+            invalidate_cache()
+            logging.info("Кнопка %s (%s) обновлена администратором %s", button_name, tenant, admin_id)
             return True
     return False
 
-def get_all_buttons() -> list:
+def get_all_buttons(tenant: str = DEFAULT_TENANT) -> list:
     """Получение списка всех кнопок"""
     with Session() as session:
-        return session.query(ButtonLink).all()
+        return session.query(ButtonLink).filter(ButtonLink.tenant == tenant).all()
 
-def get_buttons_summary() -> str:
+def get_buttons_summary(tenant: str = DEFAULT_TENANT) -> str:
     """Получение сводки по всем кнопкам для админ-панели"""
     with Session() as session:
-        buttons = session.query(ButtonLink).all()
+        buttons = session.query(ButtonLink).filter(ButtonLink.tenant == tenant).all()
         if not buttons:
             return "❌ Нет настроенных кнопок"
 
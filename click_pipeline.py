@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from activity import START_BIT, button_bit, record_activity, touch_users
+from button_config import get_button_config_by_id
+from db.engine import engine
+from db.models import Linktr, DEFAULT_TENANT
+
+Session = sessionmaker(bind=engine)
+
+
+class ClickRecorder:
+    """
+    Буфер переходов по ссылкам.
+
+    record() только добавляет строку в список и не трогает БД;
+    фоновая задача run() сбрасывает накопленное одной пакетной вставкой
+    раз в flush_interval секунд или как только набралось batch_size строк.
+    В той же транзакции обновляются дневные маски активности и first_seen/last_seen;
+    отметки /start (record_start) тоже копятся в буфере и пишутся вместе с переходами.
+
+    Если запись не удалась, строки остаются в буфере, а повторы идут с
+    нарастающей паузой (до max_retry_delay секунд). Буфер ограничен
+    max_buffer строками: при долгой недоступности БД самые старые отбрасываются.
+    """
+
+    def __init__(self, session_factory=Session, batch_size: int = 500, flush_interval: float = 1.0,
+                 max_buffer: int = 100000, max_retry_delay: float = 60.0):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_retry_delay = max_retry_delay
+        self._buffer: List[dict] = []
+        self._starts: List[dict] = []
+        self._failures = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: int, config: dict, tenant: str = DEFAULT_TENANT,
+               created_at: Optional[datetime] = None):
+        """
+        Добавляет переход в буфер. Для кнопки из БД сохраняются id и версия
+        ссылки, для конфигурации по умолчанию без id — сам URL.
+        """
+        button_id = config.get('id')
+        self._buffer.append({
+            'tenant': config.get('tenant', tenant),
+            'user_id': user_id,
+            'button_id': button_id,
+            'link_version': config.get('version') if button_id else None,
+            'link': None if button_id else config['url'],
+            'created_at': created_at or datetime.now()
+        })
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def record_start(self, user_id: int, tenant: str = DEFAULT_TENANT, created_at: Optional[datetime] = None):
+        """Добавляет в буфер отметку /start для дневной маски активности"""
+        self._starts.append({
+            'tenant': tenant,
+            'user_id': user_id,
+            'day': (created_at or datetime.now()).date(),
+            'mask': START_BIT,
+        })
+        if len(self._starts) >= self.batch_size:
+            self._wakeup.set()
+
+    @staticmethod
+    def _activity(row: dict) -> dict:
+        config = get_button_config_by_id(row['button_id']) if row['button_id'] else None
+        return {
+            'tenant': row['tenant'],
+            'user_id': row['user_id'],
+            'day': row['created_at'].date(),
+            'mask': button_bit(config['button_name']) if config else 0,
+        }
+
+    def _write(self, rows: List[dict], starts: List[dict]):
+        with self.session_factory() as session:
+            if rows:
+                session.execute(insert(Linktr), rows)
+                touch_users(session, rows)
+            record_activity(session, itertools.chain(map(self._activity, rows), starts))
+            session.commit()
+
+    async def flush(self):
+        """Записывает содержимое буфера в БД"""
+        if not self._buffer and not self._starts:
+            return
+        rows, self._buffer = self._buffer, []
+        starts, self._starts = self._starts, []
+        try:
+            await asyncio.to_thread(self._write, rows, starts)
+            self._failures = 0
+        except Exception as e:
+            self._failures += 1
+            logging.error("Не удалось сохранить %d переходов (попытка %d): %s", len(rows), self._failures, e)
+            # Возвращаем строки в буфер, чтобы повторить попытку при следующем сбросе
+            self._buffer[:0] = rows
+            self._starts[:0] = starts
+            self._trim(self._buffer, "переходов")
+            self._trim(self._starts, "отметок /start")
+
+    def _trim(self, buffer: List[dict], what: str):
+        """Отбрасывает самые старые строки сверх max_buffer"""
+        overflow = len(buffer) - self.max_buffer
+        if overflow > 0:
+            del buffer[:overflow]
+            logging.warning("Буфер переполнен, отброшено %d самых старых %s", overflow, what)
+
+    def retry_delay(self) -> float:
+        """Пауза перед повтором после failures неудачных сбросов подряд"""
+        return min(self.flush_interval * 2 ** self._failures, self.max_retry_delay)
+
+    async def run(self):
+        """Фоновый цикл сброса буфера"""
+        while True:
+            if self._failures:
+                # БД недоступна: полный буфер не ускоряет повтор
+                await asyncio.sleep(self.retry_delay())
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Останавливает фоновый цикл и дописывает остаток буфера"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+click_recorder = ClickRecorder()
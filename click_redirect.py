@@ -0,0 +1,64 @@
+import base64
+import hashlib
+import hmac
+import logging
+
+from aiohttp import web
+
+from button_config import get_button_config_by_id
+from click_pipeline import ClickRecorder, click_recorder
+
+# Длина подписи в байтах: 8 байт HMAC-SHA256 дают 11 символов в URL
+SIGNATURE_BYTES = 8
+
+
+def sign(secret: bytes, button_id: int, user_id: int) -> str:
+    """Подпись пары (кнопка, пользователь) для короткой ссылки"""
+    digest = hmac.new(secret, f"{button_id}:{user_id}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).rstrip(b'=').decode()
+
+
+def build_redirect_url(base_url: str, secret: bytes, button_id: int, user_id: int) -> str:
+    """Короткая подписанная ссылка вида {base_url}/r/{button_id}/{user_id}/{подпись}"""
+    return f"{base_url.rstrip('/')}/r/{button_id}/{user_id}/{sign(secret, button_id, user_id)}"
+
+
+def create_redirect_app(secret: bytes, recorder: ClickRecorder = click_recorder) -> web.Application:
+    """
+    aiohttp-приложение с одним маршрутом: проверяет подпись, ставит переход
+    в пакетный буфер и отвечает 302 на URL кнопки из кэша конфигурации.
+    БД в обработчике не используется.
+    """
+
+    async def redirect_handler(request: web.Request) -> web.Response:
+        match_info = request.match_info
+        try:
+            button_id = int(match_info['button_id'])
+            user_id = int(match_info['user_id'])
+        except ValueError:
+            raise web.HTTPNotFound()
+
+        if not hmac.compare_digest(match_info['sig'], sign(secret, button_id, user_id)):
+            raise web.HTTPNotFound()
+
+        config = get_button_config_by_id(button_id)
+        if not config:
+            raise web.HTTPNotFound()
+
+        recorder.record(user_id, config)
+        return web.Response(status=302, headers={'Location': config['url'], 'Cache-Control': 'no-store'})
+
+    app = web.Application()
+    app.router.add_get('/r/{button_id}/{user_id}/{sig}', redirect_handler)
+    return app
+
+
+async def start_redirect_server(secret: bytes, host: str, port: int,
+                                recorder: ClickRecorder = click_recorder) -> web.AppRunner:
+    """Запуск сервера редиректов в текущем event loop"""
+    runner = web.AppRunner(create_redirect_app(secret, recorder), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("Сервер редиректов запущен на %s:%s", host, port)
+    return runner
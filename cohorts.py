@@ -0,0 +1,229 @@
+import html
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from activity import ANY_ACTIVITY, BUTTON_BITS, START_BIT
+from db.models import DEFAULT_TENANT
+from db.snapshot import AnalyticsSnapshot, analytics
+
+EPOCH = date(1970, 1, 1)
+
+ACTIVITY_QUERY = text("""
+    SELECT user_id, day, mask
+    FROM user_daily_activity
+    WHERE tenant = :tenant
+    ORDER BY user_id, day
+""")
+
+
+class ActivityMatrix:
+    """
+    Активность бренда в плоских массивах numpy: по строке на пользователя и
+    день с действиями, строки отсортированы по (пользователь, день).
+    Дни хранятся как номер дня от 1970-01-01, маски — как в user_daily_activity.
+    """
+
+    def __init__(self, user_ids: np.ndarray, days: np.ndarray, masks: np.ndarray):
+        self.days = days.astype(np.int32)
+        self.masks = masks.astype(np.int16)
+        new_user = np.ones(len(user_ids), dtype=bool)
+        new_user[1:] = user_ids[1:] != user_ids[:-1]
+        self.user_index = np.cumsum(new_user, dtype=np.int32) - 1
+        self.user_ids = user_ids[new_user]
+        self.user_starts = np.flatnonzero(new_user)
+        self.user_ends = np.append(self.user_starts[1:], len(user_ids))
+        # Первый день активности пользователя — то же, что дата first_seen
+        self.first_day = self.days[new_user]
+        self._periods: Dict[int, Tuple] = {}
+
+    @property
+    def user_count(self) -> int:
+        return len(self.user_ids)
+
+    def periods(self, period: int) -> Tuple:
+        """
+        Разбиение строк на группы (пользователь, период) для period дней;
+        считается один раз на матрицу. Возвращает номер первого периода
+        когорт, размеры когорт, начала и концы групп, когорту и смещение
+        каждой группы.
+        """
+        if period not in self._periods:
+            user_bucket = _bucket(self.first_day, period)
+            row_bucket = _bucket(self.days, period)
+            new_group = np.ones(len(self.days), dtype=bool)
+            new_group[1:] = (self.user_index[1:] != self.user_index[:-1]) | (row_bucket[1:] != row_bucket[:-1])
+            group_starts = np.flatnonzero(new_group)
+            group_ends = np.append(group_starts[1:], len(self.days))
+            group_users = self.user_index[group_starts]
+            first_bucket = int(user_bucket.min()) if len(user_bucket) else 0
+            self._periods[period] = (
+                first_bucket,
+                np.bincount(user_bucket - first_bucket),
+                group_starts,
+                group_ends,
+                (user_bucket - first_bucket)[group_users],
+                row_bucket[group_starts] - user_bucket[group_users],
+            )
+        return self._periods[period]
+
+
+def load_activity(engine, tenant: str = DEFAULT_TENANT) -> ActivityMatrix:
+    df = pd.read_sql(ACTIVITY_QUERY, engine, params={'tenant': tenant})
+    days = np.array(df['day'].to_numpy(), dtype='datetime64[D]').astype(np.int64)
+    return ActivityMatrix(df['user_id'].to_numpy(np.int64), days, df['mask'].to_numpy())
+
+
+def _bucket(days: np.ndarray, period: int) -> np.ndarray:
+    """Номер периода; недели начинаются с понедельника (1970-01-01 — четверг)"""
+    return (days + 3) // 7 if period == 7 else days // period
+
+
+def _bucket_start(bucket: int, period: int) -> date:
+    return EPOCH + timedelta(days=int(bucket) * 7 - 3 if period == 7 else int(bucket) * period)
+
+
+def retention(matrix: ActivityMatrix, period: int = 7, periods: int = 8,
+              event_mask: int = ANY_ACTIVITY, today: Optional[date] = None) -> pd.DataFrame:
+    """
+    Матрица удержания: строки — когорты по периоду первого действия, колонка
+    'Пользователей' — размер когорты, колонки 0..periods-1 — сколько пользователей
+    когорты совершили действие из event_mask в k-й период после первого.
+    Периоды, которые еще не наступили, — NaN.
+    """
+    columns = ['Пользователей'] + list(range(periods))
+    if not matrix.user_count:
+        return pd.DataFrame(columns=columns)
+
+    first_bucket, sizes, group_starts, group_ends, group_cohort, group_offset = matrix.periods(period)
+    cohort_count = len(sizes)
+
+    # Группа активна, если в ней есть хотя бы одна строка с событием: разность префиксных сумм
+    flags = np.zeros(len(matrix.days) + 1, dtype=np.int32)
+    np.cumsum((matrix.masks & event_mask) != 0, out=flags[1:])
+    active = flags[group_ends] > flags[group_starts]
+
+    # Группы за пределами periods попадают в последнюю лишнюю ячейку
+    key = np.where(group_offset < periods, group_cohort * periods + group_offset, cohort_count * periods)
+    counts = np.bincount(key, weights=active, minlength=cohort_count * periods + 1)[:-1]
+    counts = counts.reshape(cohort_count, periods)
+
+    today_bucket = int(_bucket(np.array([((today or date.today()) - EPOCH).days]), period)[0])
+    elapsed = today_bucket - (first_bucket + np.arange(cohort_count))
+    counts[np.arange(periods)[None, :] > elapsed[:, None]] = np.nan
+
+    df = pd.DataFrame(counts, columns=list(range(periods)))
+    df.insert(0, 'Пользователей', sizes)
+    df.index = [_bucket_start(first_bucket + i, period) for i in range(cohort_count)]
+    df.index.name = 'Когорта'
+    return df[df['Пользователей'] > 0]
+
+
+def retention_rates(df: pd.DataFrame) -> pd.DataFrame:
+    """Матрица удержания в процентах от размера когорты"""
+    rates = df.drop(columns='Пользователей').div(df['Пользователей'], axis=0) * 100
+    rates.insert(0, 'Пользователей', df['Пользователей'])
+    return rates
+
+
+def link_funnels(matrix: ActivityMatrix, since: Optional[date] = None) -> pd.DataFrame:
+    """
+    Воронки по кнопкам: пользователи, нажавшие /start (начиная с since),
+    из них перешедшие по кнопке в день /start или позже, и перешедшие
+    по ней хотя бы в два разных дня.
+    """
+    started_rows = (matrix.masks & START_BIT) != 0
+    if since:
+        started_rows &= matrix.days >= (since - EPOCH).days
+    started_rows = np.flatnonzero(started_rows)
+    users = matrix.user_index[started_rows]
+    first = np.ones(len(users), dtype=bool)
+    first[1:] = users[1:] != users[:-1]
+
+    never = np.iinfo(np.int32).max
+    first_start = np.full(matrix.user_count, never, dtype=np.int32)
+    first_start[users[first]] = matrix.days[started_rows[first]]
+    after_start = matrix.days >= np.repeat(first_start, matrix.user_ends - matrix.user_starts)
+    masks = np.where(after_start, matrix.masks, 0)
+    started = int(first.sum())
+
+    rows = []
+    clicks = np.zeros(len(masks) + 1, dtype=np.int32)
+    for name, bit in BUTTON_BITS.items():
+        # Число дней с переходом у каждого пользователя — разность префиксных сумм по его строкам
+        np.cumsum((masks & bit) != 0, out=clicks[1:])
+        days_per_user = clicks[matrix.user_ends] - clicks[matrix.user_starts]
+        rows.append({
+            'Кнопка': name,
+            '/start': started,
+            'Переход': int(np.count_nonzero(days_per_user)),
+            'Повторный переход': int(np.count_nonzero(days_per_user >= 2)),
+        })
+    return pd.DataFrame(rows, columns=['Кнопка', '/start', 'Переход', 'Повторный переход'])
+
+
+def format_cohorts(retention_df: pd.DataFrame, funnels_df: pd.DataFrame, weeks: int = 6) -> str:
+    """Текст для админ-панели: удержание последних недельных когорт и воронки (HTML)"""
+    lines = ["👥 <b>Когорты по неделе первого визита</b>", ""]
+    if retention_df.empty:
+        lines.append("Данных об активности пока нет.")
+        return "\n".join(lines)
+
+    rates = retention_rates(retention_df.tail(weeks))
+    offsets = [column for column in rates.columns if column != 'Пользователей'][:weeks]
+    table = ["неделя  польз. " + " ".join(f"{'W' + str(k):>4}" for k in offsets)]
+    for cohort, row in rates.iterrows():
+        cells = " ".join("   ·" if pd.isna(row[k]) else f"{row[k]:>3.0f}%" for k in offsets)
+        table.append(f"{cohort:%d.%m}  {int(row['Пользователей']):>6} {cells}")
+    lines.append("<pre>" + html.escape("\n".join(table)) + "</pre>")
+
+    lines += ["", "<b>Воронки: /start → переход → повторный переход</b>"]
+    for funnel in funnels_df.itertuples(index=False):
+        started, clicked, repeated = funnel[1], funnel[2], funnel[3]
+        share = f" ({clicked / started * 100:.0f}%)" if started else ""
+        lines.append(f"• {html.escape(funnel[0])}: {started} → {clicked}{share} → {repeated}")
+    return "\n".join(lines)
+
+
+class CohortEngine:
+    """
+    Кэш матриц активности по брендам. Матрица читается из снимка для
+    аналитики один раз и перечитывается после его обновления (или через
+    max_age секунд, если снимок не обновляется, например при чтении из реплики).
+    Посчитанные отчеты хранятся до перечитывания матрицы.
+    """
+
+    def __init__(self, snapshot: AnalyticsSnapshot = analytics, max_age: float = 300):
+        self.snapshot = snapshot
+        self.max_age = max_age
+        self._cache: Dict[str, Tuple[Optional[float], float, ActivityMatrix]] = {}
+        self._reports: Dict[tuple, Tuple[pd.DataFrame, pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+
+    def matrix(self, tenant: str = DEFAULT_TENANT) -> ActivityMatrix:
+        with self._lock:
+            engine = self.snapshot.engine
+            cached = self._cache.get(tenant)
+            if cached and cached[0] == self.snapshot.refreshed_at:
+                if cached[0] is not None or time.monotonic() - cached[1] < self.max_age:
+                    return cached[2]
+            matrix = load_activity(engine, tenant)
+            self._cache[tenant] = (self.snapshot.refreshed_at, time.monotonic(), matrix)
+            self._reports = {key: value for key, value in self._reports.items() if key[0] != tenant}
+            return matrix
+
+    def report(self, tenant: str = DEFAULT_TENANT, period: int = 7, periods: int = 8) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Матрица удержания и воронки по кнопкам; до обновления матрицы результат берется из кэша"""
+        matrix = self.matrix(tenant)
+        key = (tenant, period, periods, date.today())
+        if key not in self._reports:
+            self._reports[key] = (retention(matrix, period, periods), link_funnels(matrix))
+        return self._reports[key]
+
+
+cohort_engine = CohortEngine()
@@ -0,0 +1,230 @@
+import asyncio
+import html
+import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session as OrmSession, sessionmaker
+
+from db.engine import engine
+from db.models import ButtonLinkVersion, DailyReport, Linktr, DEFAULT_TENANT
+
+Session = sessionmaker(bind=engine)
+
+# Подпись для переходов, у которых не нашлось ни версии ссылки, ни исходного URL
+UNKNOWN_LINK = 'неизвестно'
+
+
+def report_to_dict(report: DailyReport) -> Dict:
+    return {
+        'tenant': report.tenant,
+        'day': report.day,
+        'clicks': report.clicks,
+        'unique_users': report.unique_users,
+        'link_clicks': dict(report.link_clicks or {}),
+        'total_clicks': report.total_clicks,
+        'total_link_clicks': dict(report.total_link_clicks or {}),
+    }
+
+
+def _day_clicks(session: OrmSession, tenant: str, day: date):
+    """Переходы за день: по индексу (tenant, created_at), без просмотра всей таблицы"""
+    start = datetime.combine(day, time.min)
+    in_day = and_(Linktr.tenant == tenant, Linktr.created_at >= start,
+                  Linktr.created_at < start + timedelta(days=1))
+
+    link = func.coalesce(ButtonLinkVersion.url, Linktr.link)
+    by_link = session.query(link, func.count(Linktr.id)).outerjoin(
+        ButtonLinkVersion,
+        and_(ButtonLinkVersion.button_id == Linktr.button_id, ButtonLinkVersion.version == Linktr.link_version)
+    ).filter(in_day).group_by(link).all()
+    unique_users = session.query(func.count(func.distinct(Linktr.user_id))).filter(in_day).scalar()
+
+    link_clicks = {(url or UNKNOWN_LINK): count for url, count in by_link}
+    return link_clicks, unique_users or 0
+
+
+def compute_report(session: OrmSession, tenant: str, day: date,
+                   previous: Optional[DailyReport] = None) -> DailyReport:
+    """Отчет за день: дневные показатели плюс накопленные итоги предыдущего отчета"""
+    link_clicks, unique_users = _day_clicks(session, tenant, day)
+    clicks = sum(link_clicks.values())
+
+    total_link_clicks = Counter(previous.total_link_clicks if previous else {})
+    total_link_clicks.update(link_clicks)
+
+    return DailyReport(
+        tenant=tenant,
+        day=day,
+        clicks=clicks,
+        unique_users=unique_users,
+        link_clicks=link_clicks,
+        total_clicks=(previous.total_clicks if previous else 0) + clicks,
+        total_link_clicks=dict(total_link_clicks),
+    )
+
+
+def catch_up(tenant: str = DEFAULT_TENANT, today: Optional[date] = None) -> int:
+    """
+    Досчитывает отчеты за все завершившиеся дни, которых еще нет в daily_reports.
+    Первый запуск начинает с дня самого раннего перехода. Возвращает число новых отчетов.
+    """
+    today = today or date.today()
+    with Session() as session:
+        previous = session.query(DailyReport).filter(
+            DailyReport.tenant == tenant
+        ).order_by(DailyReport.day.desc()).first()
+
+        if previous:
+            day = previous.day + timedelta(days=1)
+        else:
+            first_click = session.query(func.min(Linktr.created_at)).filter(Linktr.tenant == tenant).scalar()
+            day = first_click.date() if first_click else today - timedelta(days=1)
+
+        created = 0
+        while day < today:
+            previous = compute_report(session, tenant, day, previous)
+            session.add(previous)
+            created += 1
+            day += timedelta(days=1)
+        session.commit()
+
+    if created:
+        logging.info("Ежедневные отчеты бренда %s: посчитано %d", tenant, created)
+    return created
+
+
+def rebuild_reports(tenant: str = DEFAULT_TENANT, since: Optional[date] = None) -> int:
+    """
+    Пересчитывает отчеты начиная с дня since (None — все) после переходов,
+    записанных задним числом, например импортом: сохраненный отчет сам не
+    пересчитывается, а накопленные итоги следующих дней опираются на него.
+    Дни, которые уже были разосланы, остаются отмеченными отправленными.
+    Возвращает число пересчитанных отчетов.
+    """
+    with Session() as session:
+        last_sent = session.query(func.max(DailyReport.day)).filter(
+            DailyReport.tenant == tenant, DailyReport.sent_at.is_not(None)
+        ).scalar()
+        query = session.query(DailyReport).filter(DailyReport.tenant == tenant)
+        if since:
+            query = query.filter(DailyReport.day >= since)
+        deleted = query.delete()
+        session.commit()
+
+    if not deleted:
+        # Отчетов за эти дни еще нет — их посчитает обычный catch_up
+        return 0
+    created = catch_up(tenant)
+    if last_sent:
+        mark_delivered(tenant, last_sent)
+    logging.info("Ежедневные отчеты бренда %s пересчитаны начиная с %s", tenant, since or "первого дня")
+    return created
+
+
+def latest_undelivered(tenant: str = DEFAULT_TENANT) -> Optional[Dict]:
+    """Последний еще не отправленный администраторам отчет"""
+    with Session() as session:
+        report = session.query(DailyReport).filter(
+            DailyReport.tenant == tenant, DailyReport.sent_at.is_(None)
+        ).order_by(DailyReport.day.desc()).first()
+        return report_to_dict(report) if report else None
+
+
+def mark_delivered(tenant: str, up_to: date):
+    """
+    Отмечает отправленными отчеты по день up_to включительно. Отчеты,
+    досчитанные задним числом, администраторам отдельно не рассылаются.
+    """
+    with Session() as session:
+        session.query(DailyReport).filter(
+            DailyReport.tenant == tenant, DailyReport.day <= up_to, DailyReport.sent_at.is_(None)
+        ).update({DailyReport.sent_at: datetime.now()})
+        session.commit()
+
+
+def load_reports(session: OrmSession, tenant: str = DEFAULT_TENANT, limit: Optional[int] = None) -> List[Dict]:
+    """Сохраненные отчеты бренда по возрастанию дня (limit — только последние)"""
+    query = session.query(DailyReport).filter(DailyReport.tenant == tenant)
+    if limit:
+        reports = query.order_by(DailyReport.day.desc()).limit(limit).all()[::-1]
+    else:
+        reports = query.order_by(DailyReport.day).all()
+    return [report_to_dict(report) for report in reports]
+
+
+def format_report(report: Dict) -> str:
+    """Текст отчета для Telegram (HTML)"""
+    lines = [
+        f"🗓 <b>Отчет за {report['day']:%d.%m.%Y}</b>",
+        "",
+        f"🖱 Переходов: {report['clicks']} (всего: {report['total_clicks']})",
+        f"👥 Пользователей с переходами: {report['unique_users']}",
+    ]
+    if report['link_clicks']:
+        lines += ["", "<b>По ссылкам:</b>"]
+        for link, count in sorted(report['link_clicks'].items(), key=lambda item: -item[1]):
+            lines.append(f"• {html.escape(link)}: {count}")
+    return "\n".join(lines)
+
+
+def format_reports_summary(reports: Iterable[Dict]) -> str:
+    """Краткая сводка по дням для админ-панели"""
+    lines = ["🗓 <b>Ежедневные отчеты</b>", ""]
+    for report in reports:
+        lines.append(f"{report['day']:%d.%m} — {report['clicks']} переходов, "
+                     f"{report['unique_users']} польз., всего {report['total_clicks']}")
+    return "\n".join(lines)
+
+
+class DailyReportScheduler:
+    """
+    Планировщик ежедневных отчетов внутри процесса бота.
+
+    Раз в сутки в hour часов (вне пиковой нагрузки) досчитывает отчеты за
+    завершившиеся дни и передает последний из них в deliver(tenant, report),
+    который возвращает число администраторов, получивших отчет. Отчет, не
+    доставленный никому, остается неотправленным и повторяется через
+    retry_interval секунд. При запуске сразу догоняет пропущенные дни.
+    """
+
+    def __init__(self, tenants: Iterable[str], deliver: Callable[[str, Dict], Awaitable[int]], hour: int = 3,
+                 retry_interval: float = 900):
+        self.tenants = list(tenants)
+        self.deliver = deliver
+        self.hour = hour
+        self.retry_interval = retry_interval
+
+    def seconds_until_next_run(self, now: Optional[datetime] = None) -> float:
+        now = now or datetime.now()
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    async def run_once(self) -> bool:
+        """Возвращает False, если отчет какого-либо бренда не удалось доставить"""
+        delivered_all = True
+        for tenant in self.tenants:
+            try:
+                await asyncio.to_thread(catch_up, tenant)
+                report = await asyncio.to_thread(latest_undelivered, tenant)
+                if not report:
+                    continue
+                if await self.deliver(tenant, report):
+                    await asyncio.to_thread(mark_delivered, tenant, report['day'])
+                else:
+                    delivered_all = False
+                    logging.warning("Отчет бренда %s за %s не получил ни один администратор", tenant, report['day'])
+            except Exception as e:
+                delivered_all = False
+                logging.error("Ошибка ежедневного отчета бренда %s: %s", tenant, e)
+        return delivered_all
+
+    async def run(self):
+        while True:
+            delivered_all = await self.run_once()
+            next_run = self.seconds_until_next_run()
+            await asyncio.sleep(next_run if delivered_all else min(self.retry_interval, next_run))
@@ -1,7 +1,19 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from db.models import Base
+from db.migrations import upgrade_schema
 
 engine = create_engine('sqlite:///db.sqlite3')
 
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: чтение (в т.ч. снимок для аналитики) не блокирует запись
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
 def create_db():
     Base.metadata.create_all(engine)
+    upgrade_schema(engine)
@@ -0,0 +1,186 @@
+import logging
+from typing import Dict, Tuple
+
+from sqlalchemy import UniqueConstraint, inspect, select, update, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import AddConstraint
+
+from db.models import Base, ButtonLink, ButtonLinkVersion, Linktr, DEFAULT_TENANT
+
+# Индексы прежних версий схемы, замененные составными индексами с tenant
+OBSOLETE_INDEXES = ['ix_linktrs_button_id', 'ix_linktrs_created_at_id', 'ix_linktrs_user_created_at_id']
+
+
+def _add_missing_columns(conn, table):
+    """ALTER TABLE ADD COLUMN для колонок модели, которых нет в существующей таблице"""
+    existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        default = f" DEFAULT '{column.server_default.arg}'" if column.server_default is not None else ''
+        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+        logging.info("Добавлена колонка %s.%s", table.name, column.name)
+
+
+def _rebuild_sqlite_table(conn, table):
+    """
+    Пересоздание таблицы SQLite по текущей модели с переносом данных:
+    SQLite не умеет менять ограничения UNIQUE и внешние ключи через ALTER TABLE.
+    """
+    old_name = f'{table.name}__old'
+    inspector = inspect(conn)
+    columns = ', '.join(c['name'] for c in inspector.get_columns(table.name) if c['name'] in table.c)
+    for index in inspector.get_indexes(table.name):
+        conn.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+    # legacy_alter_table: ссылки из других таблиц остаются на имя table.name, а не на __old
+    conn.execute(text('PRAGMA legacy_alter_table=ON'))
+    conn.execute(text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+    conn.execute(text('PRAGMA legacy_alter_table=OFF'))
+    table.create(conn)
+    conn.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}'))
+    conn.execute(text(f'DROP TABLE {old_name}'))
+    logging.info("Таблица %s пересоздана с новыми ограничениями", table.name)
+
+
+def _foreign_key_diff(conn, table):
+    """Внешние ключи модели, которых нет в БД, и имена ключей БД, которых нет в модели"""
+    expected = {
+        (tuple(fk.column_keys), fk.referred_table.name, tuple(element.column.name for element in fk.elements)): fk
+        for fk in table.foreign_key_constraints
+    }
+    existing = {
+        (tuple(fk['constrained_columns']), fk['referred_table'], tuple(fk['referred_columns'])): fk['name']
+        for fk in inspect(conn).get_foreign_keys(table.name)
+    }
+    missing = [fk for key, fk in expected.items() if key not in existing]
+    stale = [name for key, name in existing.items() if key not in expected]
+    return missing, stale
+
+
+def _sync_constraints(conn, table):
+    """
+    Приводит составные ограничения UNIQUE и внешние ключи таблицы к модели.
+    Например, linktrs прежних версий ссылается на users(user_id), который
+    больше не уникален, и SQLite с foreign_keys=ON отвергает любую запись в linktrs.
+    """
+    expected = {
+        tuple(c.name for c in constraint.columns): constraint
+        for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+    }
+    existing = {tuple(uc['column_names']): uc['name'] for uc in inspect(conn).get_unique_constraints(table.name)}
+    missing_fks, stale_fks = _foreign_key_diff(conn, table)
+    if set(expected) == set(existing) and not missing_fks and not stale_fks:
+        return
+
+    if conn.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(conn, table)
+        return
+    for name in stale_fks:
+        conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT {name}'))
+    for columns, name in existing.items():
+        if columns not in expected and name:
+            conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT {name}'))
+    for columns, constraint in expected.items():
+        if columns not in existing:
+            conn.execute(AddConstraint(constraint))
+    for fk in missing_fks:
+        conn.execute(AddConstraint(fk))
+
+
+def upgrade_schema(engine: Engine):
+    """
+    Доводит существующую БД до текущих моделей: create_all создает только
+    новые таблицы, а колонки и индексы старых таблиц добавляются здесь.
+    """
+    with engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+        for table in Base.metadata.sorted_tables:
+            _add_missing_columns(conn, table)
+
+        conn.execute(
+            update(ButtonLink)
+            .where(ButtonLink.version.is_(None))
+            .values(version=1, updated_at=ButtonLink.updated_at)
+        )
+
+        if conn.dialect.name != 'sqlite':
+            # Postgres не даст снять UNIQUE, на который еще ссылается устаревший внешний ключ
+            for table in Base.metadata.sorted_tables:
+                for name in _foreign_key_diff(conn, table)[1]:
+                    conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT {name}'))
+
+        for table in Base.metadata.sorted_tables:
+            _sync_constraints(conn, table)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+        # Первая версия истории для кнопок, созданных до появления button_link_versions
+        versioned = select(ButtonLinkVersion.button_id)
+        buttons = conn.execute(
+            select(ButtonLink.id, ButtonLink.version, ButtonLink.url, ButtonLink.button_text, ButtonLink.updated_at)
+            .where(ButtonLink.id.not_in(versioned))
+        ).all()
+        if buttons:
+            conn.execute(ButtonLinkVersion.__table__.insert(), [
+                {'button_id': b.id, 'version': b.version, 'url': b.url,
+                 'button_text': b.button_text, 'created_at': b.updated_at}
+                for b in buttons
+            ])
+
+
+def url_to_version_map(conn, tenant: str = DEFAULT_TENANT) -> Dict[str, Tuple[int, int]]:
+    """URL -> (button_id, version) для кнопок бренда; при повторах URL берется последняя версия"""
+    rows = conn.execute(
+        select(ButtonLinkVersion.url, ButtonLinkVersion.button_id, ButtonLinkVersion.version)
+        .join(ButtonLink, ButtonLink.id == ButtonLinkVersion.button_id)
+        .where(ButtonLink.tenant == tenant)
+        .order_by(ButtonLinkVersion.button_id, ButtonLinkVersion.version)
+    ).all()
+    return {row.url: (row.button_id, row.version) for row in rows}
+
+
+def migrate_link_clicks(engine: Engine, chunk_size: int = 5000, tenant: str = DEFAULT_TENANT) -> int:
+    """
+    Переводит старые записи linktrs со строкой URL на button_id + link_version.
+
+    Работает порциями по chunk_size строк, каждая порция — отдельная короткая
+    транзакция, поэтому миграцию можно выполнять на работающем боте.
+    Записи с URL, которого нет в истории кнопок, остаются как есть.
+    Возвращает количество переведенных строк.
+    """
+    with engine.connect() as conn:
+        url_map = url_to_version_map(conn, tenant)
+
+    migrated = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(Linktr.id, Linktr.link)
+                .where(Linktr.tenant == tenant, Linktr.button_id.is_(None),
+                       Linktr.link.is_not(None), Linktr.id > last_id)
+                .order_by(Linktr.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            params = []
+            for row in rows:
+                target = url_map.get(row.link)
+                if target:
+                    params.append({'row_id': row.id, 'button_id': target[0], 'link_version': target[1]})
+            if params:
+                conn.execute(
+                    text('UPDATE linktrs SET button_id = :button_id, link_version = :link_version, link = NULL '
+                         'WHERE id = :row_id'),
+                    params
+                )
+                migrated += len(params)
+
+    if migrated:
+        logging.info("Миграция переходов: %d записей переведено на button_id", migrated)
+    return migrated
@@ -1,8 +1,10 @@
-from sqlalchemy import BigInteger, String, ForeignKey, DateTime, Boolean  # Добавлен ForeignKey
+from sqlalchemy import BigInteger, SmallInteger, Integer, String, ForeignKey, ForeignKeyConstraint, Date, DateTime, Boolean, JSON, UniqueConstraint, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship  # Добавлен relationship
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 
+# Ключ бренда (бота) для записей, созданных до поддержки нескольких ботов
+DEFAULT_TENANT = 'default'
 
 
 class Base(DeclarativeBase):
@@ -11,12 +13,17 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (UniqueConstraint('tenant', 'user_id', name='uq_users_tenant_user_id'),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id = mapped_column(BigInteger, unique=True)
+    tenant: Mapped[str] = mapped_column(String(32), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    user_id = mapped_column(BigInteger)
     username: Mapped[str] = mapped_column(String(32), nullable=True)
     first_name: Mapped[str] = mapped_column(String(64), nullable=True)
     last_name: Mapped[str] = mapped_column(String(64), nullable=True)
+    # Первое и последнее действие (/start или переход), обновляются при записи
+    first_seen: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_seen: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
     # Связь с Linktr
     linktrs: Mapped[List["Linktr"]] = relationship(back_populates="user")
@@ -24,11 +31,22 @@ class User(Base):
 
 class Linktr(Base):
     __tablename__ = 'linktrs'
+    __table_args__ = (
+        ForeignKeyConstraint(['tenant', 'user_id'], ['users.tenant', 'users.user_id']),
+        # Индексы под keyset-пагинацию по (created_at, id), в т.ч. с фильтрами
+        Index('ix_linktrs_tenant_created_at_id', 'tenant', 'created_at', 'id'),
+        Index('ix_linktrs_button_created_at_id', 'button_id', 'created_at', 'id'),
+        Index('ix_linktrs_tenant_user_created_at_id', 'tenant', 'user_id', 'created_at', 'id'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    # Добавлен ForeignKey для связи с users.user_id
-    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.user_id'))
-    link: Mapped[str] = mapped_column(String(32), nullable=True)
+    tenant: Mapped[str] = mapped_column(String(32), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    user_id: Mapped[int] = mapped_column(BigInteger)
+    # Кнопка и версия ее ссылки на момент перехода (URL хранится в button_link_versions)
+    button_id: Mapped[Optional[int]] = mapped_column(SmallInteger, ForeignKey('button_links.id'), nullable=True)
+    link_version: Mapped[Optional[int]] = mapped_column(SmallInteger, nullable=True)
+    # Исходный URL — только для старых записей, которые не удалось сопоставить с кнопкой
+    link: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
     # Связь с User (исправлено back_populates)
@@ -36,12 +54,85 @@ class Linktr(Base):
 
 class ButtonLink(Base):
     __tablename__ = 'button_links'
+    __table_args__ = (UniqueConstraint('tenant', 'button_name', name='uq_button_links_tenant_button_name'),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    button_name: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)  # Например: 'support', 'contest'
+    tenant: Mapped[str] = mapped_column(String(32), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    button_name: Mapped[str] = mapped_column(String(50), nullable=False)  # Например: 'support', 'contest'
     button_text: Mapped[str] = mapped_column(String(100), nullable=False)  # Текст кнопки
     url: Mapped[str] = mapped_column(String(500), nullable=False)  # URL ссылки
     description: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)  # Описание для админа
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)  # Активна ли кнопка
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, onupdate=datetime.now)
     updated_by: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # ID админа, который последний раз менял
+    version: Mapped[int] = mapped_column(Integer, default=1)  # Текущая версия в button_link_versions
+
+
+class ButtonLinkVersion(Base):
+    """История ссылок кнопки: изменение URL не меняет смысл старых переходов"""
+    __tablename__ = 'button_link_versions'
+    __table_args__ = (UniqueConstraint('button_id', 'version'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    button_id: Mapped[int] = mapped_column(ForeignKey('button_links.id'), nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+    url: Mapped[str] = mapped_column(String(500), nullable=False)
+    button_text: Mapped[str] = mapped_column(String(100), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    created_by: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+
+class UserDailyActivity(Base):
+    """
+    Действия пользователя за день одной битовой маской (см. activity.py):
+    бит 0 — /start, бит 1 + i — переход по i-й кнопке из DEFAULT_BUTTONS
+    """
+    __tablename__ = 'user_daily_activity'
+    __table_args__ = (UniqueConstraint('tenant', 'user_id', 'day', name='uq_user_daily_activity_tenant_user_day'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tenant: Mapped[str] = mapped_column(String(32), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    mask: Mapped[int] = mapped_column(SmallInteger, nullable=False, default=0)
+
+
+class DataMigration(Base):
+    """Завершенные однократные переносы данных по брендам (например, восстановление активности)"""
+    __tablename__ = 'data_migrations'
+    __table_args__ = (UniqueConstraint('name', 'tenant', name='uq_data_migrations_name_tenant'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(50), nullable=False)
+    tenant: Mapped[str] = mapped_column(String(32), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    completed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+class DailyReport(Base):
+    """Итоги дня по бренду; накопленные значения получены из отчета за предыдущий день"""
+    __tablename__ = 'daily_reports'
+    __table_args__ = (UniqueConstraint('tenant', 'day', name='uq_daily_reports_tenant_day'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tenant: Mapped[str] = mapped_column(String(32), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    clicks: Mapped[int] = mapped_column(Integer, default=0)  # Переходов за день
+    unique_users: Mapped[int] = mapped_column(Integer, default=0)  # Пользователей с переходами за день
+    link_clicks: Mapped[dict] = mapped_column(JSON, default=dict)  # {url: переходов за день}
+    total_clicks: Mapped[int] = mapped_column(Integer, default=0)  # Переходов на конец дня
+    total_link_clicks: Mapped[dict] = mapped_column(JSON, default=dict)  # {url: переходов на конец дня}
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # Когда отправлен администраторам
+
+
+class ImportCheckpoint(Base):
+    """Ход массового импорта (import_data.py): пишется в той же транзакции, что и порция данных"""
+    __tablename__ = 'import_checkpoints'
+    __table_args__ = (UniqueConstraint('source', 'kind', 'tenant', name='uq_import_checkpoints_source_kind_tenant'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    source: Mapped[str] = mapped_column(String(500), nullable=False)  # Путь к файлу или ключ из --checkpoint
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)  # users или clicks
+    tenant: Mapped[str] = mapped_column(String(32), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    records: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # Обработано записей файла
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, onupdate=datetime.now)
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from db.engine import engine as write_engine
+
+
+class AnalyticsSnapshot:
+    """
+    Источник данных для выгрузок и статистики, отделенный от записи.
+
+    Для SQLite раз в refresh_interval секунд делается согласованная копия БД
+    через online backup API; тяжелые запросы идут в копию и не держат
+    блокировки на рабочей базе. Если задан replica_url (например, реплика
+    Postgres), чтение идет туда, а копия не создается.
+    """
+
+    def __init__(self, source: Engine, snapshot_path: str = 'db_snapshot.sqlite3'):
+        self.source = source
+        self.snapshot_path = snapshot_path
+        self.replica_url: Optional[str] = None
+        self.refreshed_at: Optional[float] = None
+        self._engine: Optional[Engine] = None
+        self._lock = threading.Lock()
+
+    def set_replica_url(self, url: Optional[str]):
+        """Читать из отдельной БД-реплики вместо локальной копии"""
+        self.replica_url = url
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+
+    @property
+    def engine(self) -> Engine:
+        """Движок для чтения; при первом обращении снимок создается синхронно"""
+        if self._engine is None:
+            self.refresh()
+        return self._engine
+
+    def session(self) -> Session:
+        return Session(bind=self.engine)
+
+    def refresh(self):
+        """Обновляет снимок (или подключается к реплике)"""
+        with self._lock:
+            if self.replica_url:
+                if self._engine is None:
+                    self._engine = create_engine(self.replica_url)
+                return
+            if self.source.dialect.name != 'sqlite':
+                # Без реплики читаем из основной БД: MVCC не блокирует запись
+                self._engine = self.source
+                return
+
+            started = time.monotonic()
+            source_path = self.source.url.database
+            tmp_path = f'{self.snapshot_path}.tmp'
+            src = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+            dst = sqlite3.connect(tmp_path)
+            try:
+                src.backup(dst)
+                # Копия наследует WAL от рабочей БД; для файла только на чтение он не нужен
+                dst.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                dst.close()
+                src.close()
+            os.replace(tmp_path, self.snapshot_path)
+
+            old_engine = self._engine
+            self._engine = create_engine(f'sqlite:///file:{self.snapshot_path}?mode=ro&uri=true')
+            if old_engine is not None:
+                old_engine.dispose()
+            self.refreshed_at = time.time()
+            logging.info("Снимок для аналитики обновлен за %.2f с", time.monotonic() - started)
+
+    async def run_periodic(self, interval: float):
+        """Фоновое обновление снимка каждые interval секунд"""
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logging.error("Не удалось обновить снимок для аналитики: %s", e)
+            await asyncio.sleep(interval)
+
+
+analytics = AnalyticsSnapshot(write_engine)
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import func, select
+
+from db.models import ButtonLink, Linktr, User, DEFAULT_TENANT
+from db.snapshot import analytics
+
+
+class ExportCache:
+    """
+    Кэш сгенерированных выгрузок на диске.
+
+    Ключ — бренд, вид выгрузки и версия данных (максимальный id перехода,
+    число пользователей, время последнего действия пользователя и последнего
+    изменения кнопок). Пока данные
+    не изменились, повторный запрос отдает готовый файл, а если он уже был
+    отправлен — его file_id в Telegram, без повторной загрузки.
+    Суммарный размер файлов ограничен max_bytes, старые удаляются первыми.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory: str = 'exports_cache', max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, Dict]] = None
+
+    def data_version(self, tenant: str = DEFAULT_TENANT) -> str:
+        """Версия данных бренда по снимку, из которого строится выгрузка"""
+        with analytics.session() as session:
+            max_click_id = session.scalar(select(func.max(Linktr.id)).where(Linktr.tenant == tenant))
+            users_count = session.scalar(select(func.count(User.id)).where(User.tenant == tenant))
+            last_seen = session.scalar(select(func.max(User.last_seen)).where(User.tenant == tenant))
+            buttons_updated = session.scalar(select(func.max(ButtonLink.updated_at)).where(ButtonLink.tenant == tenant))
+        seen_stamp = last_seen.strftime('%Y%m%d%H%M%S%f') if last_seen else '0'
+        buttons_stamp = buttons_updated.strftime('%Y%m%d%H%M%S%f') if buttons_updated else '0'
+        return f"{max_click_id or 0}-{users_count}-{seen_stamp}-{buttons_stamp}"
+
+    # --- индекс ---
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def _load_index(self) -> Dict[str, Dict]:
+        if self._index is None:
+            try:
+                with open(self._index_path(), encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{self._index_path()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path())
+
+    @staticmethod
+    def _key(tenant: str, kind: str) -> str:
+        return f"{tenant}:{kind}"
+
+    # --- работа с записями ---
+
+    def lookup(self, tenant: str, kind: str, version: str) -> Optional[Dict]:
+        """Запись кэша для текущей версии данных или None"""
+        with self._lock:
+            entry = self._load_index().get(self._key(tenant, kind))
+            if not entry or entry['version'] != version:
+                return None
+            if not entry.get('file_id') and not os.path.exists(entry['path']):
+                return None
+            if os.path.exists(entry['path']):
+                os.utime(entry['path'])  # для вытеснения по давности использования
+            return entry
+
+    def store(self, tenant: str, kind: str, version: str, filename: str) -> Dict:
+        """Переносит сгенерированный файл в кэш, заменяя предыдущую версию"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            index = self._load_index()
+            key = self._key(tenant, kind)
+            old = index.get(key)
+            if old and os.path.exists(old['path']):
+                os.remove(old['path'])
+
+            path = os.path.join(self.directory, os.path.basename(filename))
+            shutil.move(filename, path)
+            entry = {'version': version, 'path': path, 'filename': os.path.basename(filename), 'file_id': None}
+            index[key] = entry
+            self._evict(keep=key)
+            self._save_index()
+            return entry
+
+    def remember_file_id(self, tenant: str, kind: str, version: str, file_id: str):
+        """Сохраняет file_id отправленного документа для текущей версии"""
+        with self._lock:
+            entry = self._load_index().get(self._key(tenant, kind))
+            if entry and entry['version'] == version:
+                entry['file_id'] = file_id
+                self._save_index()
+
+    def forget_file_id(self, tenant: str, kind: str):
+        """Сбрасывает file_id, если Telegram его больше не принимает"""
+        with self._lock:
+            entry = self._load_index().get(self._key(tenant, kind))
+            if entry:
+                entry['file_id'] = None
+                self._save_index()
+
+    def _evict(self, keep: str):
+        """
+        Удаляет давно не использованные файлы, пока размер кэша больше max_bytes.
+        Только что сохраненная выгрузка keep не удаляется, даже если одна больше
+        max_bytes: ее сейчас отправят администратору.
+        """
+        index = self._index
+        files = []
+        for key, entry in index.items():
+            if key == keep:
+                continue
+            try:
+                stat = os.stat(entry['path'])
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, key, entry))
+
+        total = sum(size for _, size, _, _ in files)
+        if os.path.exists(index[keep]['path']):
+            total += os.path.getsize(index[keep]['path'])
+        for _, size, key, entry in sorted(files, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            os.remove(entry['path'])
+            total -= size
+            # file_id остается валидным и без файла на диске
+            if not entry.get('file_id'):
+                del index[key]
+            logging.info("Выгрузка %s удалена из кэша (%.1f КБ)", entry['filename'], size / 1024)
+
+
+export_cache = ExportCache()
@@ -1,35 +1,52 @@
 import pandas as pd
-from db.engine import engine
+from collections import Counter
+from sqlalchemy import text
+from db.models import DEFAULT_TENANT
+from db.snapshot import analytics
+from daily_reports import load_reports
+from cohorts import cohort_engine, retention_rates
 from datetime import datetime
 import logging
 
-def export_full_data_to_excel():
+USERS_QUERY = text("""
+    SELECT id, user_id, username, first_name, last_name
+    FROM users
+    WHERE tenant = :tenant
+""")
+
+
+def export_full_data_to_excel(tenant: str = DEFAULT_TENANT):
     """
-    Выгружает данные из таблиц 'users' и 'linktrs' в Excel-файл с двумя листами.
+    Выгружает данные из таблиц 'users' и 'linktrs' бренда tenant в Excel-файл с двумя листами.
+    Данные читаются из снимка для аналитики, а не из рабочей БД.
     Возвращает имя файла.
     """
     try:
         # Читаем данные пользователей
-        users_df = pd.read_sql("SELECT * FROM users", engine)
+        users_df = pd.read_sql(USERS_QUERY, analytics.engine, params={'tenant': tenant})
 
         # Читаем данные переходов с дополнительной информацией о пользователях
-        linktrs_df = pd.read_sql("""
+        linktrs_df = pd.read_sql(text("""
             SELECT
                 linktrs.id,
                 linktrs.user_id,
                 users.username,
                 users.first_name,
                 users.last_name,
-                linktrs.link,
+                COALESCE(button_link_versions.url, linktrs.link) AS link,
                 linktrs.created_at
             FROM linktrs
-            LEFT JOIN users ON linktrs.user_id = users.user_id
+            LEFT JOIN users ON linktrs.tenant = users.tenant AND linktrs.user_id = users.user_id
+            LEFT JOIN button_link_versions
+                ON button_link_versions.button_id = linktrs.button_id
+                AND button_link_versions.version = linktrs.link_version
+            WHERE linktrs.tenant = :tenant
             ORDER BY linktrs.created_at DESC
-        """, engine)
+        """), analytics.engine, params={'tenant': tenant})
 
-        # Генерируем имя файла с датой
+        # Генерируем имя файла с брендом и датой
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f'export_full_{timestamp}.xlsx'
+        output_filename = f'export_full_{tenant}_{timestamp}.xlsx'
 
         # Создаем Excel файл с двумя листами
         with pd.ExcelWriter(output_filename, engine='openpyxl') as writer:
@@ -54,57 +71,70 @@ def export_full_data_to_excel():
                     adjusted_width = min(max_length + 2, 50)
                     worksheet.column_dimensions[column_letter].width = adjusted_width
 
-        # Добавляем статистику
-        add_stats_to_excel(output_filename, users_df, linktrs_df)
+        # Добавляем статистику: завершившиеся дни — из ежедневных отчетов
+        with analytics.session() as session:
+            reports = load_reports(session, tenant)
+        add_stats_to_excel(output_filename, users_df, linktrs_df, reports)
+        add_cohorts_to_excel(output_filename, tenant)
 
-        logging.info(f"Данные успешно выгружены в файл: {output_filename}")
-        logging.info(f"  - Пользователей: {len(users_df)}")
-        logging.info(f"  - Переходов: {len(linktrs_df)}")
+        logging.info("Данные успешно выгружены в файл: %s", output_filename)
+        logging.info("  - Пользователей: %d", len(users_df))
+        logging.info("  - Переходов: %d", len(linktrs_df))
 
         return output_filename
 
     except Exception as e:
-        logging.error(f"Произошла ошибка при выгрузке данных: {e}")
+        logging.error("Произошла ошибка при выгрузке данных: %s", e)
         return None
 
-def export_users_only_to_excel():
+def export_users_only_to_excel(tenant: str = DEFAULT_TENANT):
     """
     Выгружает только пользователей (для обратной совместимости)
     """
     try:
-        df = pd.read_sql("SELECT * FROM users", engine)
+        df = pd.read_sql(USERS_QUERY, analytics.engine, params={'tenant': tenant})
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f'export_users_{timestamp}.xlsx'
+        output_filename = f'export_users_{tenant}_{timestamp}.xlsx'
         df.to_excel(output_filename, index=False)
         return output_filename
     except Exception as e:
-        logging.error(f"Ошибка при выгрузке пользователей: {e}")
+        logging.error("Ошибка при выгрузке пользователей: %s", e)
         return None
 
-def export_links_only_to_excel():
+def export_links_only_to_excel(tenant: str = DEFAULT_TENANT):
     """
     Выгружает только переходы по ссылкам
     """
     try:
-        df = pd.read_sql("""
+        df = pd.read_sql(text("""
             SELECT
-                linktrs.*,
+                linktrs.id,
+                linktrs.user_id,
+                COALESCE(button_link_versions.url, linktrs.link) AS link,
+                linktrs.created_at,
                 users.username
             FROM linktrs
-            LEFT JOIN users ON linktrs.user_id = users.user_id
+            LEFT JOIN users ON linktrs.tenant = users.tenant AND linktrs.user_id = users.user_id
+            LEFT JOIN button_link_versions
+                ON button_link_versions.button_id = linktrs.button_id
+                AND button_link_versions.version = linktrs.link_version
+            WHERE linktrs.tenant = :tenant
             ORDER BY linktrs.created_at DESC
-        """, engine)
+        """), analytics.engine, params={'tenant': tenant})
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f'export_links_{timestamp}.xlsx'
+        output_filename = f'export_links_{tenant}_{timestamp}.xlsx'
         df.to_excel(output_filename, index=False)
         return output_filename
     except Exception as e:
-        logging.error(f"Ошибка при выгрузке переходов: {e}")
+        logging.error("Ошибка при выгрузке переходов: %s", e)
         return None
 
-def add_stats_to_excel(filename, users_df, linktrs_df):
+def add_stats_to_excel(filename, users_df, linktrs_df, reports=None):
     """
-    Добавляет лист со статистикой в Excel файл
+    Добавляет лист со статистикой в Excel файл.
+    Если переданы ежедневные отчеты (reports), дни до последнего отчета
+    берутся из них, а из linktrs_df считаются только более поздние переходы;
+    если итог отчетов не совпадает с числом переходов, все считается по linktrs_df.
     """
     try:
         # Создаем статистику
@@ -117,21 +147,38 @@ def add_stats_to_excel(filename, users_df, linktrs_df):
         stats_data.append(['Дата выгрузки', datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
         stats_data.append([])
 
+        link_counts = Counter()
+        daily_counts = []
+        recent_df = linktrs_df
+        created_dates = pd.to_datetime(linktrs_df['created_at']).dt.date
+        if reports:
+            covered = int((created_dates <= reports[-1]['day']).sum())
+            if covered != reports[-1]['total_clicks']:
+                # Переходы записаны задним числом после расчета отчетов — считаем по самим переходам
+                logging.warning("Ежедневные отчеты расходятся с переходами (%d против %d), статистика считается заново",
+                                reports[-1]['total_clicks'], covered)
+                reports = None
+        if reports:
+            link_counts.update(reports[-1]['total_link_clicks'])
+            daily_counts = [(report['day'], report['clicks']) for report in reports if report['clicks']]
+            recent_df = linktrs_df[created_dates > reports[-1]['day']]
+
+        if not recent_df.empty:
+            link_counts.update(recent_df['link'].value_counts().to_dict())
+            created_dates = pd.to_datetime(recent_df['created_at']).dt.date
+            daily_counts += list(created_dates.value_counts().sort_index().items())
+
         # Статистика по ссылкам
-        if not linktrs_df.empty:
+        if link_counts:
             stats_data.append(['Статистика по ссылкам', 'Количество переходов'])
-            link_stats = linktrs_df['link'].value_counts()
-            for link, count in link_stats.items():
+            for link, count in link_counts.most_common():
                 stats_data.append([f'Ссылка: {link}', count])
 
             stats_data.append([])
 
             # Статистика по дням
             stats_data.append(['Переходы по дням', ''])
-            linktrs_df['created_at'] = pd.to_datetime(linktrs_df['created_at'])
-            daily_stats = linktrs_df['created_at'].dt.date.value_counts().sort_index()
-
-            for date, count in daily_stats.items():
+            for date, count in daily_counts:
                 stats_data.append([str(date), count])
 
         # Создаем DataFrame со статистикой
@@ -147,7 +194,29 @@ def add_stats_to_excel(filename, users_df, linktrs_df):
             worksheet.column_dimensions['B'].width = 20
 
     except Exception as e:
-        logging.error(f"Ошибка при добавлении статистики: {e}")
+        logging.error("Ошибка при добавлении статистики: %s", e)
+
+def add_cohorts_to_excel(filename, tenant: str = DEFAULT_TENANT):
+    """
+    Добавляет лист 'Когорты': удержание недельных когорт в процентах
+    и воронки /start → переход → повторный переход по каждой кнопке
+    """
+    try:
+        retention_df, funnels_df = cohort_engine.report(tenant)
+        rates = retention_rates(retention_df).round(1)
+        rates.columns = ['Пользователей'] + [f'Неделя {k}, %' for k in rates.columns[1:]]
+        rates.index = rates.index.map(str)
+
+        with pd.ExcelWriter(filename, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
+            rates.to_excel(writer, sheet_name='Когорты', index_label='Когорта (неделя)')
+            funnels_df.to_excel(writer, sheet_name='Когорты', index=False, startrow=len(rates) + 3)
+
+            worksheet = writer.sheets['Когорты']
+            worksheet.column_dimensions['A'].width = 20
+            worksheet.cell(row=len(rates) + 3, column=1, value='Воронки по кнопкам')
+
+    except Exception as e:
+        logging.error("Ошибка при добавлении когорт: %s", e)
 
 # Для обратной совместимости оставляем старую функцию
 export_users_to_excel = export_full_data_to_excel
@@ -163,13 +232,14 @@ if __name__ == "__main__":
     print("2. Только пользователи")
     print("3. Только переходы")
     choice = input("Выберите тип экспорта (1-3): ")
+    tenant = input(f"Бренд (Enter — {DEFAULT_TENANT}): ").strip() or DEFAULT_TENANT
 
     if choice == "1":
-        filename = export_full_data_to_excel()
+        filename = export_full_data_to_excel(tenant)
     elif choice == "2":
-        filename = export_users_only_to_excel()
+        filename = export_users_only_to_excel(tenant)
     elif choice == "3":
-        filename = export_links_only_to_excel()
+        filename = export_links_only_to_excel(tenant)
     else:
         print("Неверный выбор")
         filename = None
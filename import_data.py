@@ -0,0 +1,313 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from activity import backfill_activity, dialect_insert
+from button_config import init_default_buttons
+from daily_reports import rebuild_reports
+from db.engine import engine, create_db
+from db.migrations import url_to_version_map
+from db.models import ButtonLink, ImportCheckpoint, Linktr, User, DEFAULT_TENANT
+
+USER_FIELDS = ['tenant', 'user_id', 'username', 'first_name', 'last_name']
+CLICK_FIELDS = ['tenant', 'user_id', 'button_id', 'link_version', 'link', 'created_at']
+
+# Сколько отклоненных строк выводить в лог подробно
+MAX_REPORTED_ERRORS = 20
+
+
+class RejectedRecord(ValueError):
+    """Запись файла, которую не удалось разобрать (некорректный JSON или CSV)"""
+
+
+def read_records(path: str, file_format: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Потоковое чтение CSV (с заголовком) или JSONL, по одной записи.
+    Вместо неразборчивой строки выдается RejectedRecord, чтобы она учлась как
+    отклоненная, а нумерация записей для контрольной точки не сбилась.
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            while True:
+                try:
+                    record = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    record = RejectedRecord(f"некорректная строка CSV: {e}")
+                yield record
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    record = RejectedRecord(f"некорректный JSON: {e}")
+                yield record
+
+
+def _text(value, max_length: int) -> Optional[str]:
+    if value is None or value == '':
+        return None
+    return str(value)[:max_length]
+
+
+class UserValidator:
+    """Проверка строки пользователя; ValueError при некорректных данных"""
+
+    def __init__(self, tenant: str):
+        self.tenant = tenant
+
+    def __call__(self, record: Dict) -> Dict:
+        user_id = int(record['user_id'])
+        if user_id <= 0:
+            raise ValueError(f"некорректный user_id: {user_id}")
+        return {
+            'tenant': self.tenant,
+            'user_id': user_id,
+            'username': _text(record.get('username'), 32),
+            'first_name': _text(record.get('first_name'), 64),
+            'last_name': _text(record.get('last_name'), 64),
+        }
+
+
+class ClickValidator:
+    """
+    Проверка строки перехода. Кнопка определяется по полю button (имя кнопки)
+    или по URL из истории ссылок; неизвестный URL сохраняется как есть в link.
+    """
+
+    def __init__(self, conn, tenant: str):
+        self.tenant = tenant
+        self.url_map = url_to_version_map(conn, tenant)
+        self.buttons = {
+            row.button_name: (row.id, row.version)
+            for row in conn.execute(
+                select(ButtonLink.button_name, ButtonLink.id, ButtonLink.version)
+                .where(ButtonLink.tenant == tenant)
+            )
+        }
+
+    def __call__(self, record: Dict) -> Dict:
+        user_id = int(record['user_id'])
+        if user_id <= 0:
+            raise ValueError(f"некорректный user_id: {user_id}")
+        created_at = datetime.fromisoformat(str(record['created_at']))
+
+        button = record.get('button')
+        link = record.get('link') or record.get('url')
+        if button:
+            if button not in self.buttons:
+                raise ValueError(f"неизвестная кнопка: {button}")
+            target = self.buttons[button]
+        elif link:
+            target = self.url_map.get(link)
+        else:
+            raise ValueError("нет ни button, ни link")
+
+        return {
+            'tenant': self.tenant,
+            'user_id': user_id,
+            'button_id': target[0] if target else None,
+            'link_version': target[1] if target else None,
+            'link': None if target else _text(link, 500),
+            'created_at': created_at,
+        }
+
+
+def _upsert_users_sqlite(conn, rows: List[Dict]):
+    stmt = sqlite_insert(User)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.tenant, User.user_id],
+        set_={
+            'username': stmt.excluded.username,
+            'first_name': stmt.excluded.first_name,
+            'last_name': stmt.excluded.last_name,
+        }
+    )
+    conn.execute(stmt, rows)
+
+
+def _copy_rows(conn, table: str, columns: List[str], rows: List[Dict]):
+    """COPY FROM STDIN для Postgres (psycopg2)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    cursor = conn.connection.driver_connection.cursor()
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _upsert_users_postgres(conn, rows: List[Dict]):
+    conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS users_import (LIKE users INCLUDING DEFAULTS) ON COMMIT DROP")
+    _copy_rows(conn, 'users_import', USER_FIELDS, rows)
+    conn.exec_driver_sql(
+        "INSERT INTO users (tenant, user_id, username, first_name, last_name) "
+        "SELECT DISTINCT ON (user_id) tenant, user_id, username, first_name, last_name FROM users_import "
+        "ON CONFLICT (tenant, user_id) DO UPDATE SET username = EXCLUDED.username, "
+        "first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name"
+    )
+
+
+def write_users(conn, rows: List[Dict]):
+    if conn.dialect.name == 'postgresql':
+        _upsert_users_postgres(conn, rows)
+    else:
+        _upsert_users_sqlite(conn, rows)
+
+
+def write_clicks(conn, rows: List[Dict]):
+    if conn.dialect.name == 'postgresql':
+        _copy_rows(conn, 'linktrs', CLICK_FIELDS, rows)
+    else:
+        conn.execute(insert(Linktr), rows)
+
+
+def _load_checkpoint(conn, source: str, kind: str, tenant: str) -> int:
+    return conn.scalar(
+        select(ImportCheckpoint.records)
+        .where(ImportCheckpoint.source == source, ImportCheckpoint.kind == kind, ImportCheckpoint.tenant == tenant)
+    ) or 0
+
+
+def _save_checkpoint(conn, source: str, kind: str, tenant: str, records: int):
+    stmt = dialect_insert(conn)(ImportCheckpoint).values(
+        source=source, kind=kind, tenant=tenant, records=records, updated_at=datetime.now()
+    )
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[ImportCheckpoint.source, ImportCheckpoint.kind, ImportCheckpoint.tenant],
+        set_={'records': stmt.excluded.records, 'updated_at': stmt.excluded.updated_at}
+    ))
+
+
+def _clear_checkpoint(conn, source: str, kind: str, tenant: str):
+    conn.execute(
+        delete(ImportCheckpoint)
+        .where(ImportCheckpoint.source == source, ImportCheckpoint.kind == kind, ImportCheckpoint.tenant == tenant)
+    )
+
+
+def import_file(kind: str, path: str, chunk_size: int = 50000, checkpoint: Optional[str] = None,
+                file_format: Optional[str] = None, tenant: str = DEFAULT_TENANT) -> int:
+    """
+    Импорт пользователей или переходов из файла порциями по chunk_size.
+
+    Число обработанных записей сохраняется в import_checkpoints в той же
+    транзакции, что и порция, поэтому повторный запуск продолжает ровно с
+    этого места. Ключ — checkpoint (по умолчанию полный путь к файлу), вид
+    данных и бренд. Для переходов вторичные индексы linktrs снимаются на
+    время загрузки и строятся заново в конце.
+    Возвращает количество записанных строк.
+    """
+    source = checkpoint or os.path.abspath(path)
+    create_db()
+    # На новой БД кнопок еще нет, и переходы с полем button отклонялись бы как неизвестные
+    init_default_buttons(tenant)
+    deferred_indexes = list(Linktr.__table__.indexes) if kind == 'clicks' else []
+
+    with engine.connect() as conn:
+        skip = _load_checkpoint(conn, source, kind, tenant)
+        if skip:
+            logging.info("Продолжение импорта с записи %d", skip)
+        if conn.dialect.name == 'sqlite':
+            # В режиме WAL fsync только на контрольных точках журнала, а не на каждую порцию
+            conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+            conn.exec_driver_sql("PRAGMA cache_size=-200000")
+        validate = UserValidator(tenant) if kind == 'users' else ClickValidator(conn, tenant)
+        write = write_users if kind == 'users' else write_clicks
+        conn.commit()
+
+        with conn.begin():
+            for index in deferred_indexes:
+                index.drop(conn, checkfirst=True)
+
+        processed = skip
+        written = 0
+        first_click: Optional[datetime] = None
+        rejected = 0
+        started = time.monotonic()
+        records = itertools.islice(read_records(path, file_format), skip, None)
+
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+
+            rows = []
+            for offset, record in enumerate(chunk):
+                try:
+                    if isinstance(record, RejectedRecord):
+                        raise record
+                    rows.append(validate(record))
+                except (KeyError, TypeError, ValueError) as e:
+                    rejected += 1
+                    if rejected <= MAX_REPORTED_ERRORS:
+                        logging.warning("Запись %d отклонена: %s", processed + offset + 1, e)
+
+            if rows and kind == 'clicks':
+                chunk_first = min(row['created_at'] for row in rows)
+                first_click = min(first_click, chunk_first) if first_click else chunk_first
+            processed += len(chunk)
+            with conn.begin():
+                if rows:
+                    write(conn, rows)
+                _save_checkpoint(conn, source, kind, tenant, processed)
+            written += len(rows)
+
+            elapsed = time.monotonic() - started
+            logging.info("Обработано %d записей, %.0f строк/с", processed, written / elapsed if elapsed else 0)
+
+        if deferred_indexes:
+            logging.info("Построение индексов linktrs...")
+            with conn.begin():
+                for index in deferred_indexes:
+                    index.create(conn, checkfirst=True)
+
+        with conn.begin():
+            _clear_checkpoint(conn, source, kind, tenant)
+
+    if kind == 'clicks':
+        # Маски активности и first_seen/last_seen для загруженных переходов
+        backfill_activity(engine, tenant)
+        # Отчеты за дни с загруженными переходами устарели; после продолжения
+        # прерванного импорта самый ранний день прошлых порций неизвестен — пересчитываются все
+        if skip or first_click:
+            rebuild_reports(tenant, None if skip else first_click.date())
+
+    elapsed = time.monotonic() - started
+    logging.info("Импорт завершен: записано %d, отклонено %d, %.1f с (%.0f строк/с)",
+                 written, rejected, elapsed, written / elapsed if elapsed else 0)
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Массовый импорт пользователей и переходов из CSV/JSONL")
+    parser.add_argument('kind', choices=['users', 'clicks'], help="Что импортировать")
+    parser.add_argument('path', help="Файл CSV (с заголовком) или JSONL")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Формат файла (по умолчанию по расширению)")
+    parser.add_argument('--chunk-size', type=int, default=50000, help="Строк в одной транзакции")
+    parser.add_argument('--checkpoint', help="Ключ контрольной точки (по умолчанию полный путь к файлу)")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT, help="Бренд, в который импортируются данные")
+    args = parser.parse_args()
+
+    import_file(args.kind, args.path, args.chunk_size, args.checkpoint, args.format, args.tenant)
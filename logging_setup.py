@@ -0,0 +1,182 @@
+import itertools
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler
+from typing import Dict, List, Optional
+
+# Стандартные атрибуты LogRecord — всё остальное считаем полями из extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Логгер для частых сообщений о действиях пользователей (/start, переходы)
+ACTIVITY_LOGGER = 'bot.activity'
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записи в одну строку JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только каждую N-ю запись INFO/DEBUG для указанных логгеров.
+    Предупреждения и ошибки не отбрасываются никогда.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self._every = {}
+        self._counters = {}
+        for name, rate in sample_rates.items():
+            if rate >= 1:
+                continue
+            self._every[name] = max(1, round(1 / rate)) if rate > 0 else 0
+            self._counters[name] = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = self._every.get(record.name)
+        if every is None or record.levelno >= logging.WARNING:
+            return True
+        if every == 0:
+            return False
+        return next(self._counters[record.name]) % every == 0
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный QueueHandler.prepare() вызывает format() прямо в event loop;
+    здесь запись уходит в очередь как есть, а сообщение собирается
+    уже в потоке слушателя.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class BatchingQueueListener(threading.Thread):
+    """
+    Фоновый поток: забирает записи из очереди пачками и пишет
+    каждую пачку в поток вывода одним вызовом write().
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_queue: queue.SimpleQueue, handlers: List[logging.Handler],
+                 batch_size: int = 256, flush_interval: float = 0.5):
+        super().__init__(name='log-listener', daemon=True)
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is self._STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is self._STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List[logging.LogRecord]):
+        for handler in self.handlers:
+            records = [r for r in batch if r.levelno >= handler.level and handler.filter(r)]
+            if not records:
+                continue
+            if not isinstance(handler, logging.StreamHandler):
+                for record in records:
+                    handler.handle(record)
+                continue
+            lines = []
+            for record in records:
+                try:
+                    lines.append(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+            with handler.lock:
+                try:
+                    if handler.stream is None:
+                        # FileHandler с delay=True открывает файл при первой записи
+                        handler.stream = handler._open()
+                    handler.stream.write(''.join(lines))
+                    handler.flush()
+                except Exception:
+                    # Как StreamHandler.emit: ошибка ввода-вывода (например, нет места на диске)
+                    # теряет эту порцию, но не останавливает поток записи
+                    handler.handleError(records[0])
+
+    def stop(self):
+        """Дописывает остаток очереди и останавливает поток"""
+        self.queue.put(self._STOP)
+        self.join()
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(level: str = 'INFO', json_format: bool = False, log_file: Optional[str] = None,
+                  sample_rates: Optional[Dict[str, float]] = None, batch_size: int = 256,
+                  flush_interval: float = 0.5) -> BatchingQueueListener:
+    """
+    Настраивает корневой логгер: в event loop запись только кладётся в очередь,
+    форматирование и вывод выполняет фоновый поток.
+    Возвращает запущенного слушателя, его нужно остановить при выходе.
+    """
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    if sample_rates:
+        # Фильтр на стороне очереди: отброшенные записи вообще не попадают в поток
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = BatchingQueueListener(log_queue, handlers, batch_size, flush_interval)
+    listener.start()
+    return listener
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class _TimingStats:
+    """Количество вызовов, суммарное и максимальное время"""
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Время выполнения обработчиков (по имени функции)"""
+
+    def __init__(self, stats: Dict[str, _TimingStats]):
+        self.stats = stats
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event_: Any, data: Dict[str, Any]) -> Any:
+        name = data['handler'].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event_, data)
+        finally:
+            self.stats[name].add(time.perf_counter() - started)
+
+
+class Profiler:
+    """
+    Профилирование по запросу администратора.
+
+    Пока профилирование выключено, ни middleware, ни обработчики событий
+    SQLAlchemy, ни фоновые задачи не зарегистрированы — бот работает без
+    каких-либо дополнительных затрат. На время сеанса подключаются:
+    замер времени обработчиков, замер SQL-запросов, измерение задержки
+    event loop с захватом стека при блокировке и выборка стека потока
+    event loop для поиска горячих точек.
+    """
+
+    def __init__(self, dp: Dispatcher, sample_interval: float = 0.01,
+                 lag_interval: float = 0.05, block_threshold: float = 0.2):
+        self.dp = dp
+        self.sample_interval = sample_interval
+        self.lag_interval = lag_interval
+        self.block_threshold = block_threshold
+        self.active = False
+        self._reset()
+
+    def _reset(self):
+        self.handler_stats: Dict[str, _TimingStats] = defaultdict(_TimingStats)
+        self.sql_stats: Dict[str, _TimingStats] = defaultdict(_TimingStats)
+        self.lag_samples: List[float] = []
+        self.blocked_stacks: Counter = Counter()
+        self.hot_frames: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[datetime] = None
+
+    # --- SQL ---
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profiler_start')
+        if starts:
+            self.sql_stats[' '.join(statement.split())].add(time.perf_counter() - starts.pop())
+
+    # --- event loop ---
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            self.lag_samples.append(max(0.0, loop.time() - expected))
+
+    @staticmethod
+    def _frame_key(frame) -> str:
+        """Текущая функция и ближайший вызывающий кадр из кода бота"""
+        def describe(f):
+            return f"{os.path.basename(f.f_code.co_filename)}:{f.f_lineno} {f.f_code.co_name}"
+
+        key = describe(frame)
+        caller = frame
+        while caller is not None and not caller.f_code.co_filename.startswith(PROJECT_DIR):
+            caller = caller.f_back
+        if caller is not None and caller is not frame:
+            key += f" <- {describe(caller)}"
+        return key
+
+    def _sampler(self, loop_thread_id: int):
+        """Фоновый поток: выборка стека event loop и детектор блокировок"""
+        blocked_since_heartbeat = None
+        while self.active:
+            time.sleep(self.sample_interval)
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.hot_frames[self._frame_key(frame)] += 1
+
+            heartbeat = self._heartbeat
+            if time.monotonic() - heartbeat > self.block_threshold + self.lag_interval:
+                # Один стек на каждую блокировку
+                if blocked_since_heartbeat != heartbeat:
+                    blocked_since_heartbeat = heartbeat
+                    self.blocked_stacks[''.join(traceback.format_stack(frame))] += 1
+
+    # --- управление ---
+
+    def start(self):
+        self._reset()
+        self.active = True
+        self.started_at = datetime.now()
+        self._heartbeat = time.monotonic()
+
+        self._middleware = HandlerTimingMiddleware(self.handler_stats)
+        self.dp.message.middleware.register(self._middleware)
+        self.dp.callback_query.middleware.register(self._middleware)
+        # На класс Engine: учитываются и рабочая БД, и пересоздаваемый снимок для аналитики
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        self._lag_task = asyncio.create_task(self._measure_lag())
+        self._thread = threading.Thread(target=self._sampler, args=(threading.get_ident(),),
+                                        name='profiler-sampler', daemon=True)
+        self._thread.start()
+        logging.info("Профилирование запущено")
+
+    def stop(self):
+        self.active = False
+        self._thread.join()
+        self._lag_task.cancel()
+        self.dp.message.middleware.unregister(self._middleware)
+        self.dp.callback_query.middleware.unregister(self._middleware)
+        event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        logging.info("Профилирование остановлено")
+
+    async def finish_after(self, duration: float) -> str:
+        """Останавливает запущенный сеанс через duration секунд; возвращает текст отчета"""
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.stop()
+        return self.report(duration)
+
+    async def profile(self, duration: float) -> str:
+        """Профилирование в течение duration секунд"""
+        self.start()
+        return await self.finish_after(duration)
+
+    def report(self, duration: float) -> str:
+        lines = [f"Профиль бота: {self.started_at:%d.%m.%Y %H:%M:%S}, {duration:.0f} с", ""]
+
+        lines.append("== Обработчики (по суммарному времени) ==")
+        lines.append(f"{'обработчик':<32} {'вызовов':>8} {'всего, мс':>10} {'сред., мс':>10} {'макс., мс':>10}")
+        for name, s in sorted(self.handler_stats.items(), key=lambda item: -item[1].total):
+            lines.append(f"{name:<32} {s.count:>8} {s.total * 1000:>10.1f} "
+                         f"{s.total / s.count * 1000:>10.2f} {s.max * 1000:>10.1f}")
+        lines.append("")
+
+        lines.append("== Задержка event loop ==")
+        if self.lag_samples:
+            lags = sorted(self.lag_samples)
+            lines.append(f"замеров: {len(lags)}, медиана: {lags[len(lags) // 2] * 1000:.1f} мс, "
+                         f"p99: {lags[int(len(lags) * 0.99)] * 1000:.1f} мс, макс.: {lags[-1] * 1000:.1f} мс")
+        lines.append(f"блокировок дольше {self.block_threshold * 1000:.0f} мс: {sum(self.blocked_stacks.values())}")
+        for stack, count in self.blocked_stacks.most_common(5):
+            lines.append(f"-- стек при блокировке (x{count}):")
+            lines.append(stack)
+        lines.append("")
+
+        lines.append(f"== Горячие точки event loop (выборок: {self.samples}) ==")
+        for frame, count in self.hot_frames.most_common(20):
+            lines.append(f"{count / self.samples * 100:6.1f}%  {frame}")
+        lines.append("")
+
+        lines.append("== SQL (топ по суммарному времени) ==")
+        for statement, s in sorted(self.sql_stats.items(), key=lambda item: -item[1].total)[:15]:
+            lines.append(f"{s.total * 1000:9.1f} мс  x{s.count:<6} макс. {s.max * 1000:.1f} мс  {statement[:300]}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,181 @@
+import logging
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from aiogram import Dispatcher
+from aiogram.client.session.base import BaseSession
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Логгер со счетчиками по каждому обновлению (поля handler, sql, transactions, api_calls)
+METRICS_LOGGER = 'bot.metrics'
+
+COUNTERS = ('sql', 'transactions', 'api_calls')
+
+
+class Budget(NamedTuple):
+    """Допустимое число обращений на одно обновление; None — без ограничения"""
+    sql: Optional[int] = None
+    transactions: Optional[int] = None
+    api_calls: Optional[int] = None
+
+
+def budget(sql: Optional[int] = None, transactions: Optional[int] = None, api_calls: Optional[int] = None):
+    """
+    Объявляет бюджет обработчика. Ставится под декоратором регистрации:
+
+        @dp.message(CommandStart())
+        @budget(sql=1, transactions=1, api_calls=1)
+        async def command_start_handler(...)
+    """
+    def decorator(func):
+        func.call_budget = Budget(sql, transactions, api_calls)
+        return func
+    return decorator
+
+
+class UpdateCounters:
+    """Счетчики обращений к БД и Bot API в рамках одного обновления"""
+    __slots__ = ('handler', 'budget', 'sql', 'transactions', 'api_calls')
+
+    def __init__(self):
+        self.handler: Optional[str] = None
+        self.budget: Optional[Budget] = None
+        self.sql = 0
+        self.transactions = 0
+        self.api_calls = 0
+
+    def over_budget(self) -> List[str]:
+        """Счетчики, превысившие бюджет обработчика"""
+        if self.budget is None:
+            return []
+        return [name for name in COUNTERS
+                if getattr(self.budget, name) is not None and getattr(self, name) > getattr(self.budget, name)]
+
+
+# Счетчики текущего обновления; asyncio.to_thread копирует контекст, поэтому
+# запросы из рабочих потоков тоже учитываются
+_current: ContextVar[Optional[UpdateCounters]] = ContextVar('update_counters', default=None)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counters = _current.get()
+    if counters is not None:
+        counters.sql += 1
+
+
+def _count_transaction(conn):
+    counters = _current.get()
+    if counters is not None:
+        counters.transactions += 1
+
+
+class _HandlerStats:
+    """Число обновлений, сумма и максимум каждого счетчика, превышения бюджета"""
+    __slots__ = ('updates', 'total', 'max', 'over_budget', 'budget')
+
+    def __init__(self):
+        self.updates = 0
+        self.total = dict.fromkeys(COUNTERS, 0)
+        self.max = dict.fromkeys(COUNTERS, 0)
+        self.over_budget = 0
+        self.budget: Optional[Budget] = None
+
+    def add(self, counters: UpdateCounters):
+        self.updates += 1
+        self.budget = counters.budget
+        for name in COUNTERS:
+            value = getattr(counters, name)
+            self.total[name] += value
+            if value > self.max[name]:
+                self.max[name] = value
+
+
+class UpdateMetrics:
+    """
+    Учет SQL-запросов, транзакций и вызовов Bot API на каждое обновление.
+
+    Внешний middleware на update заводит счетчики в contextvar, внутренний на
+    message/callback_query подписывает их именем обработчика и его бюджетом,
+    обработчики событий SQLAlchemy и middleware HTTP-сессии бота увеличивают
+    их. После обработки счетчики пишутся в лог METRICS_LOGGER, суммируются
+    по обработчикам, а превышение бюджета выводится предупреждением.
+    """
+
+    def __init__(self):
+        self.stats: Dict[str, _HandlerStats] = defaultdict(_HandlerStats)
+        self.last: Optional[UpdateCounters] = None
+        self.log = logging.getLogger(METRICS_LOGGER)
+
+    def install(self, dp: Dispatcher, session: BaseSession):
+        dp.update.outer_middleware.register(self.update_middleware)
+        dp.message.middleware.register(self.handler_middleware)
+        dp.callback_query.middleware.register(self.handler_middleware)
+        session.middleware(self.request_middleware)
+        if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+            event.listen(Engine, 'before_cursor_execute', _count_statement)
+            event.listen(Engine, 'begin', _count_transaction)
+
+    async def update_middleware(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                                update: Any, data: Dict[str, Any]) -> Any:
+        counters = UpdateCounters()
+        token = _current.set(counters)
+        try:
+            return await handler(update, data)
+        finally:
+            _current.reset(token)
+            self.record(counters)
+
+    async def handler_middleware(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                                 event_: Any, data: Dict[str, Any]) -> Any:
+        counters = _current.get()
+        if counters is not None:
+            callback = data['handler'].callback
+            counters.handler = callback.__name__
+            counters.budget = getattr(callback, 'call_budget', None)
+        return await handler(event_, data)
+
+    async def request_middleware(self, make_request, bot, method):
+        counters = _current.get()
+        if counters is not None:
+            counters.api_calls += 1
+        return await make_request(bot, method)
+
+    def record(self, counters: UpdateCounters):
+        if counters.handler is None and not (counters.sql or counters.transactions or counters.api_calls):
+            return
+        name = counters.handler or '<без обработчика>'
+        self.last = counters
+        stats = self.stats[name]
+        stats.add(counters)
+
+        fields = {'handler': name, 'sql': counters.sql, 'transactions': counters.transactions,
+                  'api_calls': counters.api_calls}
+        self.log.info("Обновление %s: SQL %d, транзакций %d, вызовов API %d",
+                      name, counters.sql, counters.transactions, counters.api_calls, extra=fields)
+        exceeded = counters.over_budget()
+        if exceeded:
+            stats.over_budget += 1
+            self.log.warning("Обработчик %s превысил бюджет: %s", name, ", ".join(
+                f"{counter} {getattr(counters, counter)} > {getattr(counters.budget, counter)}" for counter in exceeded
+            ), extra=fields)
+
+    def reset(self):
+        self.stats.clear()
+        self.last = None
+
+    def report(self) -> str:
+        """Таблица по обработчикам: среднее/максимум и бюджет каждого счетчика"""
+        lines = [f"{'обработчик':<28} {'обн.':>6} {'SQL ср/макс/бюдж':>17} "
+                 f"{'TX ср/макс/бюдж':>16} {'API ср/макс/бюдж':>17} {'превыш.':>8}"]
+        for name, s in sorted(self.stats.items(), key=lambda item: -item[1].updates):
+            cells = []
+            for counter in COUNTERS:
+                limit = getattr(s.budget, counter) if s.budget else None
+                cells.append(f"{s.total[counter] / s.updates:.1f}/{s.max[counter]}/{'-' if limit is None else limit}")
+            lines.append(f"{name[:28]:<28} {s.updates:>6} {cells[0]:>17} {cells[1]:>16} {cells[2]:>17} {s.over_budget:>8}")
+        return "\n".join(lines)
+
+
+update_metrics = UpdateMetrics()